@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+"""
+Memory of a long running renderer: renders the same report many times in a
+row, each one in a `Report` context, sampling the RSS. The process should
+stay flat once the caches are warm; exits with 1 if the RSS of the second
+half grows more than the threshold.
+
+    python bench_leak.py [--template PATH] [--reports N] [--threshold MB] [--lazy]
+
+By default the pages are built eagerly, so the widget trees are destroyed
+by `Report.close()`; with --lazy they are released once painted.
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+import sys
+import argparse
+import resource
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5.QtWidgets import QApplication
+
+import wreports
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")
+
+
+def rss():
+    """
+    Current resident set size in MB (peak size where /proc is missing)
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except IOError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # bytes on macOS, kB elsewhere
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--template", default=os.path.join(DATA_DIR, "image+text-document.wrp"))
+    args.add_argument("--reports", type=int, default=10000)
+    args.add_argument("--samples", type=int, default=10)
+    args.add_argument("--threshold", type=float, default=10.0,
+                      help="RSS growth (MB) in the second half reported as leak (default 10)")
+    args.add_argument("--lazy", action="store_true", help="build LazyPages")
+    opts = args.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    template = os.path.abspath(opts.template)
+    os.chdir(os.path.dirname(template))
+    template = wreports.load_template(template)
+    every = max(1, opts.reports // opts.samples)
+    samples = []
+    for index in range(1, opts.reports + 1):
+        with wreports.Report(template, lazy=opts.lazy) as report:
+            for _ in wreports.iter_paint_pages(wreports.pdf_writer(os.devnull), report.pages):
+                pass
+        if index % every == 0:
+            samples.append((index, rss()))
+            print("%8d reports %10.1f MB" % samples[-1])
+            sys.stdout.flush()
+    half = samples[len(samples) // 2:]
+    growth = half[-1][1] - half[0][1]
+    print("second half growth %.1f MB" % growth)
+    if growth > opts.threshold:
+        print("LEAK: RSS grows more than %.1f MB" % opts.threshold)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
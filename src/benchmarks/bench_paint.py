@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+"""
+Pages per second of the two pdf paint paths: the QPicture recorded and
+replayed on a QPrinter, and the direct render on a QPdfWriter.
+
+    python bench_paint.py [--template PATH] [--copies N] [--repeat N]
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PyQt5.QtWidgets import QApplication
+
+import wreports
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")
+
+
+def pages_per_second(device_factory, make_pages, filename, repeat):
+    best = None
+    for _ in range(repeat):
+        # fresh pages for each run, the first paint of a page also lays it out
+        pages = make_pages()
+        start = time.time()
+        count = sum(1 for _ in wreports.iter_paint_pages(device_factory(filename), pages))
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best, count
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--template", default=os.path.join(DATA_DIR, "image+text-document.wrp"))
+    args.add_argument("--copies", type=int, default=10)
+    args.add_argument("--repeat", type=int, default=3)
+    opts = args.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    template = os.path.abspath(opts.template)
+    os.chdir(os.path.dirname(template))
+
+    def make_pages():
+        pages = []
+        for _ in range(opts.copies):
+            with open(template, "rb") as source:
+                pages.extend(wreports.parse(source))
+        return pages
+
+    fd, filename = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        picture, count = pages_per_second(wreports.pdf_printer, make_pages, filename, opts.repeat)
+        direct, _ = pages_per_second(wreports.pdf_writer, make_pages, filename, opts.repeat)
+    finally:
+        os.remove(filename)
+    print("%d pages" % count)
+    print("%-28s %10.1f pages/s" % ("QPicture on QPrinter", picture))
+    print("%-28s %10.1f pages/s" % ("direct on QPdfWriter", direct))
+    print("%-28s %10.2fx" % ("speedup", direct / picture))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+"""
+Microbenchmark of the `parse` hot path on templates with many <text> and
+<label> elements, compares the pooled bbcode / mistune renderers with the
+old per element setup, and both with the html `render_cache`.
+
+    python bench_parse.py [--elements N] [--repeat N]
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+import sys
+import timeit
+import argparse
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import bbcode
+import mistune
+
+from PyQt5.QtWidgets import QApplication
+
+import wreports
+from wreports import parser, markup
+
+
+TEXT = """
+    | code | description         | amount |
+    |:-----|:--------------------|-------:|
+    | 001  | [b]first[/b] line   |  10.00 |
+    | 002  | second line         |  20.00 |
+"""
+
+
+def text_label_template(elements):
+    body = []
+    for i in range(elements):
+        body.append('<label name="label%d">Label **%d**</label>' % (i, i % 10))
+        body.append('<text name="text%d">%s</text>' % (i, TEXT))
+    return '<report version="1.2"><section name="s">%s</section></report>' % "\n".join(body)
+
+
+def legacy_text_to_html(text):
+    bbcode.g_parser = bbcode.Parser(newline='\n', replace_cosmetic=False)
+    code = bbcode.render_html(text)
+    return mistune.Markdown(markup.QTextEditRenderer())(code)
+
+
+def legacy_label_to_html(text):
+    return mistune.markdown(text)
+
+
+def bench(label, func, repeat, number):
+    best = min(timeit.repeat(func, repeat=repeat, number=number)) / number
+    print("%-28s %10.3f ms" % (label, best * 1000))
+    return best
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--elements", type=int, default=300)
+    args.add_argument("--repeat", type=int, default=5)
+    opts = args.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    source = text_label_template(opts.elements)
+    template = wreports.compile_template(source)
+    text = TEXT.strip()
+
+    print("%d <text> + %d <label> elements" % (opts.elements, opts.elements))
+    pooled = bench("text to html (pooled)", lambda: markup._text_to_html(text), opts.repeat, 200)
+    legacy = bench("text to html (per element)", lambda: legacy_text_to_html(text), opts.repeat, 200)
+    print("%-28s %10.2fx" % ("speedup", legacy / pooled))
+    pooled = bench("label to html (pooled)", lambda: markup._label_to_html("Label **1**"), opts.repeat, 200)
+    legacy = bench("label to html (per element)", lambda: legacy_label_to_html("Label **1**"), opts.repeat, 200)
+    print("%-28s %10.2fx" % ("speedup", legacy / pooled))
+
+    parser.build(template)  # warm up
+    cached = bench("build (render cache)", lambda: parser.build(template), opts.repeat, 1)
+    print("%-28s %r" % ("render cache", markup.render_cache.info()))
+    # a zero sized cache evicts each entry as soon as it is stored, the
+    # entries of the cached run must go too or they are still hit
+    maxsize, markup.render_cache.maxsize = markup.render_cache.maxsize, 0
+    markup.render_cache.clear()
+    try:
+        pooled = bench("build (pooled)", lambda: parser.build(template), opts.repeat, 1)
+        saved = markup._text_to_html, markup._label_to_html
+        markup._text_to_html, markup._label_to_html = legacy_text_to_html, legacy_label_to_html
+        try:
+            legacy = bench("build (per element)", lambda: parser.build(template), opts.repeat, 1)
+        finally:
+            markup._text_to_html, markup._label_to_html = saved
+    finally:
+        markup.render_cache.maxsize = maxsize
+    print("%-28s %10.2fx" % ("speedup (pooled)", legacy / pooled))
+    print("%-28s %10.2fx" % ("speedup (render cache)", legacy / cached))
+
+
+if __name__ == '__main__':
+    main()
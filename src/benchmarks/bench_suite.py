@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+"""
+Benchmark suite, times parse (cold and warm caches), paint_pages and pdf
+output of synthetic templates (see `synthetic.py`) and of the data/*.wrp
+samples, on the offscreen Qt platform. Results are written as json, compare
+them with a previous run to spot regressions.
+
+    python bench_suite.py [--output results.json] [--repeat N] [--quick]
+                          [--compare baseline.json] [--threshold 0.2]
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import platform
+import tempfile
+import argparse
+import contextlib
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from PyQt5.QtCore import QT_VERSION_STR
+from PyQt5.QtWidgets import QApplication
+
+import wreports
+
+import synthetic
+
+DATA_DIR = os.path.join(BENCH_DIR, "..", "..", "data")
+
+# name -> `synthetic.generate` arguments
+SYNTHETIC_CASES = [
+    ("single", dict(sections=1, depth=1, texts=1, rows=10)),
+    ("sections-50", dict(sections=50, depth=2, texts=1, rows=10)),
+    ("deep-nesting", dict(sections=5, depth=7, texts=0, rows=0)),
+    ("long-tables", dict(sections=2, depth=1, texts=4, rows=200)),
+    ("assets-dense", dict(sections=20, depth=3, texts=0, rows=0, svgs=2, images=1)),
+]
+
+QUICK_CASES = ("single", "long-tables", "assets-dense")
+
+METRICS = ("parse_cold", "parse_warm", "paint", "pdf")
+
+
+def clear_caches():
+    for cache in (wreports.template_cache, wreports.render_cache,
+                  wreports.svg_cache, wreports.image_cache):
+        cache.clear()
+
+
+@contextlib.contextmanager
+def working_dir(path):
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def best_of(repeat, func, setup=None):
+    best = None
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure(source, repeat, scratch):
+    """
+    Timings of a template, `source` is a callable returning the xml string
+    or an open file.
+    """
+    pdf = os.path.join(scratch, "out.pdf")
+
+    def cold_setup():
+        clear_caches()
+        return (source(),)
+
+    def pages():
+        return (wreports.parse(source()),)
+
+    def paint(pages):
+        return wreports.painter.paint_pages(wreports.pdf_printer(os.devnull), pages)
+
+    def write_pdf(pages):
+        for _ in wreports.iter_paint_pages(wreports.pdf_writer(pdf), pages):
+            pass
+
+    result = {
+        "parse_cold": best_of(repeat, wreports.parse, cold_setup),
+        "parse_warm": best_of(repeat, lambda: wreports.parse(source())),
+        # painted pages can't be painted again, each round parses its own
+        "paint": best_of(repeat, paint, pages),
+        "pdf": best_of(repeat, write_pdf, pages),
+    }
+    result["pages"] = len(paint(*pages()))
+    result["pdf_bytes"] = os.path.getsize(pdf)
+    return result
+
+
+def run(repeat, quick, scratch):
+    cases = {}
+    assets = synthetic.write_assets(scratch)
+    for name, params in SYNTHETIC_CASES:
+        if quick and name not in QUICK_CASES:
+            continue
+        xml = synthetic.generate(assets=assets, **params)
+        print("%-28s" % name, end="")
+        sys.stdout.flush()
+        cases[name] = dict(measure(lambda: xml, repeat, scratch), params=params)
+        print(" %.3fs" % sum(cases[name][metric] for metric in METRICS))
+    # fixed cases, the samples use paths relative to the data dir
+    with working_dir(DATA_DIR):
+        for path in sorted(glob.glob("*.wrp")):
+            name = "data/" + path
+            print("%-28s" % name, end="")
+            sys.stdout.flush()
+            cases[name] = measure(lambda: open(path, "rb"), repeat, scratch)
+            print(" %.3fs" % sum(cases[name][metric] for metric in METRICS))
+    return cases
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the ratio of each timing to the `baseline` one, returns the list
+    of regressions, the timings slower than `1 + threshold` times.
+    """
+    regressions = []
+    print()
+    print("%-28s %s" % ("vs baseline", "".join("%12s" % metric for metric in METRICS)))
+    for name, case in sorted(results["cases"].items()):
+        old = baseline["cases"].get(name)
+        if old is None:
+            continue
+        ratios = []
+        for metric in METRICS:
+            ratio = case[metric] / old[metric] if old.get(metric) else float("nan")
+            flag = "!" if ratio > 1 + threshold else " "
+            if flag == "!":
+                regressions.append((name, metric, ratio))
+            ratios.append("%10.2fx%s" % (ratio, flag))
+        print("%-28s %s" % (name, "".join(ratios)))
+    return regressions
+
+
+def main():
+    args = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    args.add_argument("--output", default="bench-results.json")
+    args.add_argument("--repeat", type=int, default=3)
+    args.add_argument("--quick", action="store_true", help="only a few synthetic cases")
+    args.add_argument("--compare", metavar="BASELINE", help="results of a previous run")
+    args.add_argument("--threshold", type=float, default=0.2,
+                      help="slowdown reported as regression (default 0.2, 20%%)")
+    opts = args.parse_args()
+
+    app = QApplication.instance() or QApplication([])
+    scratch = tempfile.mkdtemp()
+    try:
+        cases = run(opts.repeat, opts.quick, scratch)
+    finally:
+        shutil.rmtree(scratch)
+    results = {
+        "wreports": wreports.__version__,
+        "python": platform.python_version(),
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": opts.repeat,
+        "cases": cases,
+    }
+    with open(opts.output, "w") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    print("results written to %s" % opts.output)
+
+    if opts.compare:
+        with open(opts.compare) as baseline:
+            regressions = compare(results, json.load(baseline), opts.threshold)
+        for name, metric, ratio in regressions:
+            print("REGRESSION %s %s %.2fx" % (name, metric, ratio))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*
+"""
+Synthetic wreport templates with a controllable shape, for the benchmarks.
+
+    source = generate(sections=20, depth=3, texts=2, rows=40, svgs=2, images=1,
+                      assets=write_assets(tmpdir))
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+
+LOGO_SVG = b"""<svg xmlns="http://www.w3.org/2000/svg" width="120" height="60">
+  <rect x="2" y="2" width="116" height="56" rx="8" fill="#3465a4" stroke="#204a87"/>
+  <circle cx="30" cy="30" r="18" fill="#fce94f"/>
+  <text x="56" y="36" font-size="16" fill="white">ACME</text>
+</svg>"""
+
+
+def write_assets(directory):
+    """
+    Write the svg and png used by the synthetic templates in `directory`,
+    returns their paths as `(svg, png)`.
+    """
+    from PyQt5.QtGui import QImage, QPainter, QLinearGradient, QColor
+    svg = os.path.join(directory, "logo.svg")
+    with open(svg, "wb") as logo:
+        logo.write(LOGO_SVG)
+    png = os.path.join(directory, "photo.png")
+    image = QImage(640, 480, QImage.Format_RGB32)
+    gradient = QLinearGradient(0, 0, 640, 480)
+    gradient.setColorAt(0, QColor("#729fcf"))
+    gradient.setColorAt(1, QColor("#4e9a06"))
+    painter = QPainter(image)
+    painter.fillRect(image.rect(), gradient)
+    painter.end()
+    image.save(png)
+    return svg, png
+
+
+def _table(rows):
+    lines = ["| code | description | qty | amount |",
+             "|:-----|:------------|----:|-------:|"]
+    for i in range(rows):
+        lines.append("| %04d | item [b]%d[/b] with a longer description | %d | %d.%02d |"
+                     % (i, i, i % 7 + 1, i * 3, i % 100))
+    return "\n".join(lines)
+
+
+def _leaves(index, svgs, images, assets):
+    items = ['<label name="label%d">Label **%d**</label>' % (index, index)]
+    for i in range(svgs):
+        items.append('<svg name="svg%d_%d" src="%s"/>' % (index, i, assets[0]))
+    for i in range(images):
+        items.append('<image name="image%d_%d" src="%s" width="120"/>' % (index, i, assets[1]))
+    items.append('<hline/>')
+    return items
+
+
+def _nested(depth, index, svgs, images, assets):
+    if depth == 0:
+        return "\n".join(_leaves(index, svgs, images, assets))
+    tag = "row" if depth % 2 else "col"
+    children = "\n".join(_nested(depth - 1, index * 2 + i, svgs, images, assets) for i in range(2))
+    return '<%s spacing="2" margins="(1,1,1,1)">\n%s\n</%s>' % (tag, children, tag)
+
+
+def generate(sections=1, depth=1, texts=1, rows=10, svgs=0, images=0, assets=None):
+    """
+    Template with `sections` sections, each one with a `depth` levels tree
+    of alternated <row>/<col> (two children per level, labels and `svgs` +
+    `images` assets on the leaves) and `texts` markdown tables of `rows`
+    rows. `assets` is the `(svg, png)` pair of `write_assets`, needed if
+    there are svgs or images.
+    """
+    body = []
+    for section in range(sections):
+        parts = ['<section name="section%d" margins="(20,20,20,20)">' % section,
+                 _nested(depth, 0, svgs, images, assets)]
+        for text in range(texts):
+            parts.append('<text name="text%d">\n%s\n</text>' % (text, _table(rows)))
+        parts.append('</section>')
+        body.append("\n".join(parts))
+    return '<report version="1.2">\n%s\n</report>\n' % "\n".join(body)
@@ -1,12 +1,47 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*
 
+import gc
+import os
+import shutil
+import tempfile
 import unittest
 
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt5.QtGui import QImage, QImageReader
+from PyQt5.QtWidgets import QApplication, QLabel
 
 from wreports import *
+import wreports
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data")
+
+app = QApplication.instance() or QApplication([])
+
+
+def _has_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return False
+    return True
 
 
+SIMPLE_REPORT = """<report version="1.2">
+  <section name="first" margins="(1,2,3,4)">
+    <row spacing="5">
+      <label name="title">Title</label>
+    </row>
+    <text>
+      | a | b |
+      |---|---|
+      | 1 | 2 |
+    </text>
+  </section>
+  <section name="second"/>
+</report>
+"""
 
 
 class WreportsTestCase(unittest.TestCase):
@@ -15,12 +50,652 @@ class WreportsTestCase(unittest.TestCase):
         raise Exception("Not implemented")
 
 
+class TemplateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        wreports.template_cache.clear()
+
+    def test_compile_parses_attributes(self):
+        template = wreports.compile_template(SIMPLE_REPORT)
+        section = template.root.children[0]
+        self.assertEqual(section.tag, "section")
+        self.assertEqual(dict(section.attrs)["margins"], (1, 2, 3, 4))
+        self.assertEqual(dict(section.children[0].attrs)["spacing"], 5)
+        self.assertIn("| 1 | 2 |", section.children[1].text)
+        self.assertEqual(section.children[1].line, 6)
+
+    def test_compile_cache(self):
+        template = wreports.compile_template(SIMPLE_REPORT)
+        self.assertIs(wreports.compile_template(SIMPLE_REPORT), template)
+        self.assertIsNot(wreports.compile_template(SIMPLE_REPORT, cache=False), template)
+        self.assertEqual(wreports.template_cache.info().hits, 1)
+
+    def test_lazy_imports(self):
+        import subprocess
+        import sys
+        code = ("import sys, wreports; wreports.compile_template('<report version=\"1\"/>');"
+                "print(sorted(m for m in sys.modules if m.split('.')[0] in ('PyQt5', 'mistune', 'bbcode')))")
+        src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=src)
+        self.assertEqual(output.strip(), b"[]")
+        for module, names in wreports._LAZY_EXPORTS.items():
+            self.assertEqual(sorted(names), sorted(getattr(wreports, module).__all__))
+
+    def test_logging(self):
+        with self.assertLogs("wreports", "DEBUG") as logs:
+            wreports.parse(SIMPLE_REPORT)
+        self.assertIn("DEBUG:wreports.parser:this template use version 1.2", logs.output)
+
+    def test_iter_sections(self):
+        consumed = []
+        def chunks():
+            for i in range(0, len(SIMPLE_REPORT), 10):
+                consumed.append(i)
+                yield SIMPLE_REPORT[i:i + 10]
+        sections = wreports.iter_sections(chunks())
+        report, first = next(sections)
+        self.assertEqual(dict(report.attrs)["version"], "1.2")
+        self.assertEqual(first, wreports.compile_template(SIMPLE_REPORT).root.children[0])
+        self.assertTrue(consumed[-1] + 10 < len(SIMPLE_REPORT))
+        self.assertEqual([dict(s.attrs)["name"] for _, s in sections], ["second"])
+
+    def test_iterparse(self):
+        pages = list(wreports.iterparse(SIMPLE_REPORT))
+        self.assertEqual(len(pages), 2)
+        self.assertIsNotNone(pages[0].findChild(QLabel, "title"))
+        lazy = list(wreports.iterparse(SIMPLE_REPORT, lazy=True))
+        self.assertEqual([page.name for page in lazy], ["first", "second"])
+        self.assertRaises(wreports.errors.TagError, list, wreports.iterparse("<report/>"))
+
+        def chunks():
+            yield "<report><section>"
+            self.fail("read past <report>")
+        self.assertRaises(wreports.errors.TagError, next, wreports.iterparse(chunks()))
+
+    def test_load_template_cache(self):
+        path = os.path.join(DATA_DIR, "image-preview.wrp")
+        template = wreports.load_template(path)
+        self.assertIs(wreports.load_template(path), template)
+        with open(path, "rb") as source:
+            self.assertIs(wreports.compile_template(source), template)
+
+    def test_file_key_after_chdir(self):
+        cwd = os.getcwd()
+        tmp = tempfile.mkdtemp()
+        try:
+            for name in ("a", "b"):
+                os.mkdir(os.path.join(tmp, name))
+                with open(os.path.join(tmp, name, "report.wrp"), "w") as report:
+                    report.write('<report version="%s"/>' % name)
+            os.chdir(os.path.join(tmp, "a"))
+            with open("report.wrp", "rb") as source:
+                os.chdir(os.path.join(tmp, "b"))
+                wreports.load_template("report.wrp")
+                template = wreports.compile_template(source)
+            self.assertEqual(dict(template.root.attrs)["version"], "a")
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(tmp)
+
+    def test_build(self):
+        template = wreports.compile_template(SIMPLE_REPORT)
+        pages = wreports.build(template)
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[0].findChild(QLabel, "title").text(), "<p>Title</p>")
+        self.assertEqual(len(wreports.build(template)), 2)
+
+
+class ValidatorTestCase(unittest.TestCase):
+
+    def test_valid_samples(self):
+        for path in ("image+text-document.wrp", "image-preview.wrp"):
+            self.assertEqual(wreports.validate_file(os.path.join(DATA_DIR, path)), [])
+
+    def test_all_problems(self):
+        problems = wreports.validate("""<report>
+  <section child_layout="grid" margins="(1,2)" foo="1">
+    <label horizontal="Wide">x<hline/></label>
+    <row><image src="missing.png" width="x"/><vline color="#12"/></row>
+    <table/>
+  </section>
+</report>""", DATA_DIR)
+        self.assertEqual([(p.line, p.severity) for p in problems],
+                         [(1, "error")] + [(2, "error")] * 3 + [(3, "error")] * 2 +
+                         [(4, "warning"), (4, "error"), (4, "error"), (5, "error")])
+        self.assertIn("unknown tag <table>", problems[-1].message)
+
+    def test_xml_error(self):
+        problems = wreports.validate('<report version="1.2">\n<section>\n</report>')
+        self.assertEqual(problems[0].line, 3)
+        self.assertTrue(problems[0].message.startswith("xml: "))
+
+    def test_tag_signatures(self):
+        import inspect
+        from wreports import parser, validator
+        for tag, attributes in validator.TAG_ATTRIBUTES.items():
+            args = inspect.getfullargspec(parser._TAGS[tag]).args
+            unknown = set(args) - set(attributes) - set(["widget", "layout"])
+            self.assertEqual(unknown, set(), tag)
+
+
+class MarkdownTestCase(unittest.TestCase):
+
+    def test_pooled_renderer_is_reset(self):
+        from wreports import markup
+        text = "| a |\n|---|\n| 1 |\n| 2 |\n| 3 |"
+        html = markup._text_to_html(text)
+        self.assertEqual(markup._text_to_html(text), html)
+        self.assertEqual(html.count('class="odd"'), 2)
+
+    def test_label_is_escaped(self):
+        from wreports import markup
+        self.assertEqual(markup._label_to_html("a <b> **c**").strip(),
+                         "<p>a &lt;b&gt; <strong>c</strong></p>")
+
+    def test_render_cache(self):
+        wreports.render_cache.clear()
+        wreports.parse(SIMPLE_REPORT)
+        pages = wreports.parse(SIMPLE_REPORT)
+        info = wreports.render_cache.info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 2, 2))
+        self.assertEqual(wreports.render_cache.currbytes,
+                         sum(len(html) for html in wreports.render_cache._data.values()))
+        self.assertEqual(pages[0].findChild(QLabel, "title").text(), "<p>Title</p>")
+
+
+class HeadlessTestCase(unittest.TestCase):
+
+    def test_paint_without_widgets(self):
+        from PyQt5.QtCore import QRectF
+        from PyQt5.QtGui import QPainter
+        from wreports import headless
+        gc.collect()
+        widgets = len(QApplication.allWidgets())
+        pages = headless.parse(SIMPLE_REPORT)
+        self.assertEqual([page.name for page in pages], ["first", "second"])
+        image = QImage(400, 600, QImage.Format_ARGB32)
+        painter = QPainter(image)
+        headless.paint_page(painter, pages[0], QRectF(0, 0, 400, 600))
+        painter.end()
+        self.assertEqual(pages[0].pageCount(), 1)
+        self.assertEqual(pages[0].root.rect.width(), 400)
+        self.assertEqual(len(QApplication.allWidgets()), widgets)
+
+    def test_text_continuation_pages(self):
+        from PyQt5.QtCore import QSizeF
+        from wreports import headless
+        pages = headless.parse(open(os.path.join(DATA_DIR, "image+text-document.wrp"), "rb"))
+        pages[0].layout(QSizeF(794, 1123))
+        self.assertEqual(pages[0].pageCount(), 3)
+        self.assertEqual(pages[1].pageCount(), 1)
+
+
+SVG_REPORT = """<report version="1.2">
+  <section name="logo">
+    <svg name="first" src="data://logo"/>
+    <svg name="second" src="data://logo"/>
+  </section>
+</report>
+"""
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><rect width="10" height="10"/></svg>'
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def test_shared_svg_renderers(self):
+        renderers = {}
+        pages = wreports.build(wreports.compile_template(SVG_REPORT), {"logo": SVG}, renderers=renderers)
+        first = pages[0].findChild(wreports.parser.AspectRatioSvgWidget, "first")
+        second = pages[0].findChild(wreports.parser.AspectRatioSvgWidget, "second")
+        self.assertEqual(len(renderers), 1)
+        self.assertIs(first.renderer(), second.renderer())
+        self.assertEqual(first.sizeHint().width(), 10)
+
+    def test_svg_cache(self):
+        wreports.svg_cache.clear()
+        template = wreports.compile_template(SVG_REPORT)
+        first = wreports.build(template, {"logo": SVG})[0].findChild(wreports.parser.AspectRatioSvgWidget, "first")
+        second = wreports.build(template, {"logo": SVG})[0].findChild(wreports.parser.AspectRatioSvgWidget, "first")
+        self.assertIs(first.renderer(), second.renderer())
+        self.assertEqual(len(wreports.svg_cache), 1)
+        self.assertEqual(wreports.svg_cache.currbytes, len(SVG))
+
+    def test_svg_data_buffers(self):
+        from PyQt5.QtCore import QByteArray
+        wreports.svg_cache.clear()
+        template = wreports.compile_template(SVG_REPORT)
+        renderers = set()
+        for data in (SVG, bytearray(SVG), memoryview(SVG), QByteArray(SVG), SVG.decode("utf-8")):
+            pages = wreports.build(template, {"logo": data})
+            svg = pages[0].findChild(wreports.parser.AspectRatioSvgWidget, "first")
+            self.assertEqual(svg.sizeHint().width(), 10)
+            renderers.add(svg.renderer())
+        self.assertEqual(len(renderers), 1)
+        self.assertEqual(wreports.svg_cache.currbytes, len(SVG))
+
+    def test_cache_byte_budget(self):
+        from wreports.cache import LRUCache
+        cache = LRUCache(10, maxbytes=100)
+        cache.put("a", 1, 60)
+        cache.put("b", 2, 30)
+        cache.put("c", 3, 30)
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.currbytes, 60)
+        cache.put("b", 4, 10)
+        self.assertEqual(cache.currbytes, 40)
+
+    def test_image_cache(self):
+        wreports.image_cache.clear()
+        tmp = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmp, "photo.png")
+            source = QImage(40, 20, QImage.Format_RGB32)
+            source.fill(0)
+            source.save(src)
+            template = wreports.compile_template(
+                '<report version="1.2"><section><image src="%s" width="20"/></section></report>' % src)
+            requests = wreports.prefetch_assets(template)
+            image = wreports.scaled_image(src, 20)
+            wreports.release_prefetched(requests)
+            self.assertEqual((image.width(), image.height()), (20, 10))
+            self.assertIs(wreports.scaled_image(src, 20), image)
+            self.assertEqual(wreports.image_cache.currbytes, image.bytesPerLine() * 10)
+            self.assertTrue(wreports.scaled_image(os.path.join(tmp, "missing.png")).isNull())
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_prefetch_assets(self):
+        import threading
+        from wreports import assets
+        wreports.image_cache.clear()
+        wreports.svg_cache.clear()
+        tmp = tempfile.mkdtemp()
+        try:
+            svg, png = os.path.join(tmp, "logo.svg"), os.path.join(tmp, "photo.png")
+            with open(svg, "wb") as logo:
+                logo.write(SVG)
+            QImage(40, 20, QImage.Format_RGB32).save(png)
+            template = wreports.compile_template(
+                '<report version="1.2"><section>'
+                '<svg name="first" src="%s"/><svg name="second" src="%s"/>'
+                '<image name="photo" src="%s" width="20"/><image src="%s" width="20"/>'
+                '</section></report>' % (svg, svg, png, png))
+            stat = os.stat
+            gui_stats = []
+
+            def counting_stat(path, *args, **kwargs):
+                if threading.current_thread() is threading.main_thread():
+                    gui_stats.append(path)
+                return stat(path, *args, **kwargs)
+            assets.os.stat = counting_stat
+            try:
+                pages = wreports.build(template)
+            finally:
+                assets.os.stat = stat
+            self.assertEqual(gui_stats, [])
+            self.assertEqual(assets._pending, {})
+            first, second = pages[0].findChildren(wreports.parser.AspectRatioSvgWidget)
+            self.assertIs(first._renderer, second._renderer)
+            self.assertIs(first._renderer.thread(), app.thread())
+            self.assertEqual(pages[0].findChild(QLabel, "photo").pixmap().width(), 20)
+            # lazy pages prefetch while the previous one is painted, nothing
+            # is left behind by unpainted pages
+            with wreports.Report(template, lazy=True) as report:
+                report.pages[0].prefetch()
+            self.assertEqual(assets._pending, {})
+            list(wreports.iter_paint_pages(wreports.pdf_printer(os.devnull),
+                                           wreports.build(template, lazy=True)))
+            self.assertEqual(assets._pending, {})
+            QImage(40, 40, QImage.Format_RGB32).save(png)
+            wreports.image_cache.clear()
+            pages = wreports.build(template)
+            self.assertEqual(pages[0].findChild(QLabel, "photo").pixmap().height(), 20)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_asset_stores(self):
+        import pickle
+        wreports.svg_cache.clear()
+        tmp = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmp, "logos"))
+            with open(os.path.join(tmp, "logos", "logo"), "wb") as logo:
+                logo.write(SVG)
+            archive = os.path.join(tmp, "assets.zip")
+            wreports.write_archive(archive, {"logos/logo": SVG, "other": b"x"})
+            for store in (wreports.DirectoryStore(tmp), wreports.ArchiveStore(archive),
+                          pickle.loads(pickle.dumps(wreports.ArchiveStore(archive)))):
+                blob = store["logos"]["logo"]
+                self.assertEqual(bytes(blob.data), SVG)
+                pages = wreports.build(wreports.compile_template(SVG_REPORT), {"logo": blob})
+                svg = pages[0].findChild(wreports.parser.AspectRatioSvgWidget, "first")
+                self.assertEqual(svg.sizeHint().width(), 10)
+                self.assertRaises(KeyError, lambda: store["missing"])
+            self.assertEqual(len(wreports.svg_cache), 2)
+            store = wreports.DirectoryStore(os.path.join(tmp, "logos"))
+            for key in ("", os.pardir, os.path.join(os.pardir, "assets.zip"), archive):
+                self.assertRaises(KeyError, lambda: store[key])
+            # the alternative separator of Windows
+            altsep, os.altsep = os.altsep, "\\"
+            try:
+                self.assertRaises(KeyError, lambda: store[os.pardir + "\\assets.zip"])
+            finally:
+                os.altsep = altsep
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_data_image(self):
+        from PyQt5.QtCore import QBuffer, QByteArray
+        wreports.image_cache.clear()
+        source = QImage(40, 20, QImage.Format_RGB32)
+        source.fill(0)
+        png = QByteArray()
+        buf = QBuffer(png)
+        buf.open(QBuffer.WriteOnly)
+        source.save(buf, "PNG")
+        png = bytes(png)
+        template = wreports.compile_template(
+            '<report version="1.2"><section><image name="chart" src="data://charts:a" width="20"/>'
+            '</section></report>')
+        for data in (png, memoryview(png), source):
+            pages = wreports.build(template, {"charts": {"a": data}})
+            pixmap = pages[0].findChild(QLabel, "chart").pixmap()
+            self.assertEqual((pixmap.width(), pixmap.height()), (20, 10))
+        self.assertEqual(len(wreports.image_cache), 1)
+        # the buffer is hashed by the prefetch, not on the GUI thread
+        import threading
+        from wreports import assets
+        wreports.image_cache.clear()
+        sha1 = assets.hashlib.sha1
+        gui_hashes = []
+
+        def counting_sha1(*args):
+            if threading.current_thread() is threading.main_thread():
+                gui_hashes.append(args)
+            return sha1(*args)
+        assets.hashlib.sha1 = counting_sha1
+        try:
+            pages = wreports.build(template, {"charts": {"a": png}})
+        finally:
+            assets.hashlib.sha1 = sha1
+        self.assertEqual(gui_hashes, [])
+        self.assertEqual(assets._pending, {})
+        self.assertEqual(pages[0].findChild(QLabel, "chart").pixmap().width(), 20)
+        pages = wreports.build(template, {"charts": {}})
+        self.assertIsNone(pages[0].findChild(QLabel, "chart").pixmap())
+
+    @unittest.skipUnless(_has_numpy(), "numpy not available")
+    def test_data_image_pixels(self):
+        import numpy
+        pixels = numpy.zeros((10, 20, 3), numpy.uint8)
+        pixels[..., 0] = 255
+        image = wreports.scaled_image("data://pixels", None, 5, {"pixels": pixels})
+        self.assertEqual((image.width(), image.height()), (10, 5))
+        self.assertEqual(image.pixel(0, 0), 0xffff0000)
+
+    def test_render_batch(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            pattern = os.path.join(tmp, "report-{index}.pdf")
+            envs = [{"logo": SVG}] * 3
+            wreports.svg_cache.clear()
+            done = list(wreports.render_batch(SVG_REPORT, envs, pattern))
+            self.assertEqual([index for index, _ in done], [0, 1, 2])
+            self.assertEqual(len(wreports.svg_cache), 1)
+            for _, filename in done:
+                self.assertTrue(os.path.getsize(filename) > 0)
+        finally:
+            shutil.rmtree(tmp)
+
+
+class PainterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        cwd = os.getcwd()
+        os.chdir(DATA_DIR)
+        try:
+            self.pages = wreports.parse(open("image+text-document.wrp", "rb"))
+        finally:
+            os.chdir(cwd)
+        fd, self.filename = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_paint_page(self):
+        from PyQt5.QtGui import QPainter, QPicture
+        printer = wreports.pdf_printer(self.filename)
+        painter = QPainter(printer)
+        try:
+            page_rect = printer.pageRect(printer.DevicePixel)
+            picture = wreports.paint_page(painter, self.pages[0], page_rect)
+            self.assertIsInstance(picture, QPicture)
+            self.assertIsNone(wreports.paint_page(painter, self.pages[1], page_rect, picture=False))
+        finally:
+            painter.end()
+
+    def test_iter_paint_pages(self):
+        printer = wreports.pdf_printer(self.filename)
+        stream = wreports.iter_paint_pages(printer, self.pages, pictures=True)
+        self.assertIsNotNone(next(stream))
+        self.assertEqual(len(list(stream)), 3)
+        self.assertTrue(os.path.getsize(self.filename) > 0)
+
+    def test_paint_pages_twice(self):
+        # es. a pdf, then the thumbnails of the same pages
+        first = list(wreports.render_images(self.pages, dpi=72))
+        second = list(wreports.render_images(self.pages, dpi=72))
+        self.assertEqual(len(first), 4)
+        self.assertEqual(first, second)
+
+    def test_text_viewer_layout_once(self):
+        from wreports.parser import TextViewer
+        page = self.pages[0]
+        page.resize(794, 1123)
+        text_viewer = page.findChildren(TextViewer)[0]
+        document = text_viewer.document()
+        revision = document.revision()
+        text_viewer.setPageNumber(1)
+        text_viewer.resize(794, 1123)
+        self.assertEqual(document.revision(), revision)
+        self.assertEqual(text_viewer._pageRect(2).top(), 2 * 1123)
+
+    def test_lazy_pages(self):
+        cwd = os.getcwd()
+        os.chdir(DATA_DIR)
+        try:
+            pages = wreports.parse(open("image+text-document.wrp", "rb"), lazy=True)
+            self.assertTrue(all(isinstance(page, wreports.LazyPage) for page in pages))
+            gc.collect()
+            before = len(QApplication.allWidgets())
+            printed = list(wreports.iter_paint_pages(wreports.pdf_writer(self.filename), pages))
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(len(printed), 4)
+        gc.collect()
+        self.assertEqual(len(QApplication.allWidgets()), before)
+
+    def test_report_teardown(self):
+        from wreports.parser import TextViewer, sip
+        gc.collect()
+        before = len(QApplication.allWidgets())
+        template = wreports.compile_template(SIMPLE_REPORT)
+        for lazy in (False, True, False):
+            with wreports.Report(template, lazy=lazy) as report:
+                self.assertEqual(len(report), 2)
+                list(wreports.iter_paint_pages(wreports.pdf_printer(os.devnull), report.pages))
+                section = wreports.parser.page_widget(report.pages[0])
+                document = section.findChild(TextViewer).document()
+        self.assertTrue(sip.isdeleted(section))
+        self.assertTrue(sip.isdeleted(document))
+        self.assertEqual(report.pages, [])
+        # no collection needed
+        self.assertEqual(len(QApplication.allWidgets()), before)
+
+    def test_profiling(self):
+        from wreports import profiling
+        wreports.template_cache.clear()
+        wreports.render_cache.clear()
+        with profiling.profile() as profiler:
+            with open(os.path.join(DATA_DIR, "image+text-document.wrp"), "rb") as source:
+                template = wreports.compile_template(source)
+            pages = wreports.build(template)
+            list(wreports.iter_paint_pages(wreports.pdf_writer(self.filename), pages))
+        self.assertIsNone(profiling.active)
+        phases = set(phase for phase, _ in profiler.summary())
+        self.assertTrue(set(["xml", "attributes", "markup", "build", "layout", "paint"]) <= phases)
+        self.assertEqual(profiler.summary(("phase",))[("paint",)][0], 4)
+        self.assertTrue(all(record["template"].endswith("image+text-document.wrp")
+                            for record in profiler.export()))
+        self.assertIn("build/label", profiler.report())
+
+    def test_direct_vector_output(self):
+        writer = wreports.pdf_writer(self.filename)
+        self.assertEqual(list(wreports.iter_paint_pages(writer, self.pages)), [None] * 4)
+        with open(self.filename, "rb") as pdf:
+            self.assertNotIn(b"/Subtype /Image", pdf.read())
+
+    def test_render_images(self):
+        printer = wreports.pdf_printer()
+        page_rect = printer.pageRect(printer.DevicePixel)
+        images = list(wreports.render_images(self.pages, dpi=printer.resolution() / 2, threads=2))
+        self.assertEqual(len(images), 4)
+        self.assertEqual(images[0].width(), round(page_rect.width() / 2))
+        # not blank
+        self.assertGreater(len(set(images[0].pixel(x, y) for x in range(0, images[0].width(), 7)
+                                   for y in range(0, images[0].height(), 7))), 1)
+
+    def test_export_images(self):
+        directory = tempfile.mkdtemp()
+        try:
+            pngs = wreports.export_images(self.pages, os.path.join(directory, "page-{index}.png"),
+                                          thumbnail=(100, 100))
+            self.assertEqual(len(pngs), 4)
+            thumbnail = QImage(pngs[0])
+            self.assertTrue(max(thumbnail.width(), thumbnail.height()) == 100)
+            self.assertTrue(min(thumbnail.width(), thumbnail.height()) <= 100)
+            pages = wreports.parse(SIMPLE_REPORT)
+            tiffs = wreports.export_images(pages, os.path.join(directory, "page-{index}.tiff"), dpi=72)
+            self.assertEqual(QImageReader(tiffs[0]).format(), b"tiff")
+            pngs = wreports.export_images(pages, os.path.join(directory, "page-{index}.img"),
+                                          dpi=72, image_format="PNG")
+            self.assertEqual(QImageReader(pngs[0]).format(), b"png")
+            with self.assertRaises(wreports.errors.RenderError):
+                wreports.export_images(pages, os.path.join(directory, "missing", "{index}.png"))
+        finally:
+            shutil.rmtree(directory)
+
+
+class DisplayListTestCase(unittest.TestCase):
+
+    def test_record_and_replay(self):
+        import io
+        source = SIMPLE_REPORT.replace('name="second"', 'name="second" metadata="totals"')
+        recorded = wreports.DisplayList.record(wreports.parse(source, lazy=True))
+        data = io.BytesIO()
+        recorded.save(data)
+        data.seek(0)
+        display_list = wreports.DisplayList.load(data)
+        self.assertEqual(len(display_list), len(list(wreports.iter_paint_pages(
+            wreports.pdf_printer(os.devnull), wreports.parse(source)))))
+        self.assertEqual(display_list.pages[-1][-2:], (1, "totals"))
+        self.assertTrue(all(page.metadata is None for page in display_list.pages[:-1]))
+        self.assertEqual(display_list.pages, recorded.pages)
+        fd, filename = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        try:
+            display_list.print_to(wreports.pdf_writer(filename))
+            with open(filename, "rb") as pdf:
+                self.assertEqual(pdf.read().count(b"/Type /Page\n"), len(display_list))
+        finally:
+            os.remove(filename)
+        image = next(display_list.render_images(dpi=display_list.resolution))
+        self.assertEqual(image.width(), round(display_list.pages[0].width))
+
+    def test_invalid(self):
+        import io
+        with self.assertRaises(wreports.errors.RenderError):
+            wreports.DisplayList.load(io.BytesIO(b"not a zip"))
+
+
+class FarmTestCase(unittest.TestCase):
+
+    def test_render_farm(self):
+        from wreports.farm import RenderFarm
+        with RenderFarm(processes=1, maxtasksperchild=2, templates=[SIMPLE_REPORT]) as farm:
+            pdfs = list(farm.map(SIMPLE_REPORT, [None] * 3))
+            pictures = farm.render(SVG_REPORT, {"logo": SVG}, output="pictures")
+            display_list = farm.render(SIMPLE_REPORT, output="displaylist")
+            self.assertRaises(ValueError, farm.render, SIMPLE_REPORT, output="picture")
+            self.assertEqual(farm.processes, 1)
+        self.assertEqual(len(pdfs), 3)
+        for pdf in pdfs:
+            self.assertTrue(pdf.startswith(b"%PDF"))
+        self.assertEqual(len(pictures), 1)
+        picture = wreports.load_picture(pictures[0])
+        self.assertFalse(picture.isNull())
+        self.assertGreater(picture.boundingRect().width(), 0)
+        import io
+        self.assertEqual(wreports.DisplayList.load(io.BytesIO(display_list)).pages[-1].section, 1)
+
+    def test_async_renderer(self):
+        import asyncio
+        import xml.parsers.expat
+        from wreports.aio import AsyncRenderer
+
+        async def main():
+            async with AsyncRenderer(processes=1, max_pending=1, timeout=60) as renderer:
+                pdfs = await asyncio.gather(*[renderer.render(SIMPLE_REPORT) for _ in range(3)])
+                self.assertTrue(all(pdf.startswith(b"%PDF") for pdf in pdfs))
+                # the slot of an abandoned job is freed when the worker is done,
+                # the next job waits for it
+                with self.assertRaises(asyncio.TimeoutError):
+                    await renderer.render(SIMPLE_REPORT, timeout=0.0001)
+                pdf = await renderer.render(SIMPLE_REPORT)
+                self.assertTrue(pdf.startswith(b"%PDF"))
+                self.assertEqual(renderer.pending, 0)
+                job = asyncio.ensure_future(renderer.render(SIMPLE_REPORT))
+                await asyncio.sleep(0)
+                job.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await job
+                with self.assertRaises(xml.parsers.expat.ExpatError):
+                    await renderer.render("<report>")
+                self.assertEqual(renderer.pending, 0)
+        asyncio.run(main())
+
+    def test_async_hard_timeout(self):
+        import asyncio
+        from wreports.aio import AsyncRenderer
+
+        async def main():
+            async with AsyncRenderer(processes=1, max_pending=1, hard_timeout=0.0001) as renderer:
+                # still running after the hard timeout, the farm is restarted
+                with self.assertRaises(wreports.errors.RenderError):
+                    await renderer.render(SIMPLE_REPORT)
+                self.assertEqual(renderer.pending, 0)
+                renderer.hard_timeout = None
+                pdf = await renderer.render(SIMPLE_REPORT)
+                self.assertTrue(pdf.startswith(b"%PDF"))
+        asyncio.run(main())
+
+
 def suite():
     loader = unittest.TestLoader()
     suite = unittest.TestSuite()
     suite.addTest(loader.loadTestsFromTestCase(WreportsTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(TemplateTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(ValidatorTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(MarkdownTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(HeadlessTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(BatchTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(PainterTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(DisplayListTestCase))
+    suite.addTest(loader.loadTestsFromTestCase(FarmTestCase))
     return suite
 
 
 if __name__ == '__main__':
-    unittest.TextTestRunner(verbosity=2).run(suite())
\ No newline at end of file
+    unittest.TextTestRunner(verbosity=2).run(suite())
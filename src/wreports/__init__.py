@@ -2,10 +2,58 @@
 # encoding: utf-8
 from __future__ import print_function, absolute_import, division
 
+import sys
+import logging
+import importlib
+
 __all__ = []
 
-from .parser import *
-from .painter import *
+# silent unless the application configures logging, es.
+# logging.getLogger("wreports").setLevel(logging.DEBUG)
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+from .template import *
 
 __version__ = "0.1.0"
 
+# The rendering side (Qt, mistune, bbcode) is imported on first use, so that
+# compiling or validating templates doesn't pay for it. Keep in sync with
+# the `__all__` of each module.
+_LAZY_EXPORTS = {
+    "validator": ["Problem", "validate", "validate_file"],
+    "markup": ["render_cache"],
+    "assets": ["svg_cache", "image_cache", "scaled_image", "prefetch_assets", "release_prefetched",
+               "Blob", "DirectoryStore", "ArchiveStore", "write_archive"],
+    "parser": ["parse", "iterparse", "build", "LazyPage", "Report"],
+    "painter": ["paint_page", "iter_paint_pages", "pdf_printer", "pdf_writer", "render_batch",
+                "picture_data", "load_picture"],
+    "raster": ["record_pages", "render_images", "export_images"],
+    "displaylist": ["DisplayList", "RecordedPage"],
+}
+_LAZY = dict((name, module) for module, names in _LAZY_EXPORTS.items() for name in names)
+_SUBMODULES = ("aio", "assets", "cache", "displaylist", "errors", "farm", "headless", "markup", "painter",
+               "parser", "profiling", "raster", "template", "validator")
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in _SUBMODULES:
+            return importlib.import_module("." + name, __name__)
+        try:
+            module = _LAZY[name]
+        except KeyError:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+        value = getattr(importlib.import_module("." + module, __name__), name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_LAZY) | set(_SUBMODULES))
+else:
+    # no module __getattr__ (PEP 562), import everything
+    from .validator import *
+    from .markup import *
+    from .assets import *
+    from .parser import *
+    from .painter import *
+    from .raster import *
+    from .displaylist import *
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+"""
+Asyncio front-end of the render farm (python 3 only).
+
+Qt can't run in the event loop without blocking it, reports are rendered
+by the worker processes of a `RenderFarm` and awaited:
+
+    async with AsyncRenderer(processes=4, max_pending=16, timeout=30) as renderer:
+        pdf = await renderer.render("invoice.wrp", env)
+
+or with a process-wide renderer, started on the first call and stopped at
+exit:
+
+    pdf = await render_async("invoice.wrp", env)
+
+At most `max_pending` jobs are queued on the farm, `render` waits for a
+slot (backpressure). A job that times out or whose caller is cancelled is
+abandoned: its result is dropped, and its slot is freed only when the
+worker is done with it, so the queue never grows past `max_pending`.
+
+A worker can't be stopped in the middle of a job, a job still running
+after `hard_timeout` seconds restarts the whole farm (see `reset`), so a
+report that never ends can't hold its slot and its worker forever.
+"""
+from __future__ import print_function, absolute_import, division
+
+import atexit
+import asyncio
+import logging
+
+from . import errors
+from .farm import RenderFarm
+
+__all__ = ["AsyncRenderer", "render_async"]
+
+log = logging.getLogger(__name__)
+
+
+def _call_soon(loop, callback, *args):
+    # from a thread of the pool, the loop may be gone if the job was abandoned
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+class AsyncRenderer(object):
+    """
+    Render reports on a `RenderFarm` (by default a new one, see its
+    arguments) from asyncio code. `max_pending` (default: two jobs for
+    worker) limits the queued jobs, `timeout` is the default timeout in
+    seconds of each job, `hard_timeout` the seconds after which a job still
+    running, even if abandoned, restarts the farm.
+    """
+    def __init__(self, processes=None, max_pending=None, timeout=None, templates=(),
+                 maxtasksperchild=100, farm=None, hard_timeout=None):
+        self._own_farm = farm is None
+        if farm is None:
+            farm = RenderFarm(processes, maxtasksperchild, templates)
+        self.farm = farm
+        self.max_pending = max_pending or 2 * farm.processes
+        self.timeout = timeout
+        self.hard_timeout = hard_timeout
+        # future of each job on the farm -> its hard timeout handle
+        self._jobs = {}
+        # an asyncio.Semaphore belongs to a loop, made by the first render
+        self._loop = None
+        self._slots = None
+
+    @property
+    def pending(self):
+        """
+        Jobs on the farm, abandoned ones included
+        """
+        return len(self._jobs)
+
+    def _semaphore(self, loop):
+        if self._loop is not loop:
+            if self.pending:
+                raise RuntimeError("AsyncRenderer used by two event loops")
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+        return self._slots
+
+    async def render(self, template, env=None, output="pdf", timeout=None):
+        """
+        Render a report, returns what `RenderFarm.render` returns. Raises
+        `asyncio.TimeoutError` if the job is not done after `timeout`
+        seconds (default: the renderer one, None waits forever), and
+        `RenderError` if the job is dropped by a `reset`.
+        """
+        loop = asyncio.get_running_loop()
+        slots = self._semaphore(loop)
+        await slots.acquire()
+        result = loop.create_future()
+
+        # a single loop callback: the awaiting task resumes with the slot
+        # already free
+        def finished(value, error):
+            if result not in self._jobs:
+                # dropped by a reset, the slot is already free
+                return
+            watchdog = self._jobs.pop(result)
+            if watchdog is not None:
+                watchdog.cancel()
+            slots.release()
+            if result.done():
+                return
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(value)
+
+        def done(value):
+            _call_soon(loop, finished, value, None)
+
+        def failed(error):
+            _call_soon(loop, finished, None, error)
+
+        try:
+            self.farm.submit(template, env, output, callback=done, error_callback=failed)
+        except BaseException:
+            slots.release()
+            raise
+        watchdog = None
+        if self.hard_timeout is not None:
+            watchdog = loop.call_later(self.hard_timeout, self._expired, result)
+        self._jobs[result] = watchdog
+        if timeout is None:
+            timeout = self.timeout
+        return await asyncio.wait_for(result, timeout)
+
+    def _expired(self, result):
+        if result in self._jobs:
+            log.warning("render job running for more than %ss, restarting the farm",
+                        self.hard_timeout)
+            self.reset()
+
+    def reset(self):
+        """
+        Restart the farm workers, killing the jobs stuck on them: all the
+        pending jobs fail with `RenderError` and their slots are freed.
+        """
+        jobs, self._jobs = self._jobs, {}
+        self.farm.restart()
+        for result, watchdog in jobs.items():
+            if watchdog is not None:
+                watchdog.cancel()
+            self._slots.release()
+            if not result.done():
+                result.set_exception(errors.RenderError("render job dropped by a farm restart"))
+
+    async def close(self):
+        """
+        Wait for the pending jobs and stop the farm (if it was created by
+        the renderer)
+        """
+        if self._own_farm:
+            await asyncio.get_running_loop().run_in_executor(None, self.farm.close)
+
+    def terminate(self):
+        """
+        Stop the farm (if it was created by the renderer) now, the pending
+        jobs are lost
+        """
+        if self._own_farm:
+            self.farm.terminate()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            self.terminate()
+
+
+_renderer = None
+
+
+async def render_async(template, env=None, output="pdf", timeout=None):
+    """
+    Render a report on a process-wide `AsyncRenderer`, started with the
+    default arguments by the first call and terminated at exit.
+    """
+    global _renderer
+    if _renderer is None:
+        _renderer = AsyncRenderer()
+        atexit.register(_renderer.terminate)
+    return await _renderer.render(template, env, output, timeout)
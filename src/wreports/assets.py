@@ -0,0 +1,510 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+from __future__ import print_function, absolute_import, division
+
+import os
+import mmap
+import struct
+import hashlib
+import zipfile
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+try:
+    from PyQt5.Qt import Qt
+    from PyQt5.QtCore import QByteArray, QCoreApplication
+    from PyQt5.QtGui import QImage
+    from PyQt5.QtSvg import QSvgRenderer
+except ImportError:
+    from PyQt4.Qt import Qt
+    from PyQt4.QtCore import QByteArray, QCoreApplication
+    from PyQt4.QtGui import QImage
+    from PyQt4.QtSvg import QSvgRenderer
+
+from collections import namedtuple
+
+from . import errors
+from . import profiling
+from .cache import LRUCache
+
+__all__ = ["svg_cache", "image_cache", "scaled_image", "prefetch_assets", "release_prefetched",
+           "Blob", "DirectoryStore", "ArchiveStore", "write_archive"]
+
+
+# shown in place of a missing or invalid svg
+ERROR_SVG = b"""
+            <svg>
+            <rect width="100%" height="100%" fill='white' stroke="red" stroke-width="1"/>
+            <text fill="red" font-size="8" font-family="Verdana" x="30%" y="45%">
+            Error: Missing svg
+            </text>
+            </svg>"""
+
+
+def resolve_data(env, src, line):
+    """
+    Resolve a `data://a:b` source into `env["a"]["b"]`
+    """
+    if env is None:
+        raise errors.TagError("Cannot use data:// without `env`")
+    multikey = src[len("data://"):]
+    keys = multikey.split(":")
+    # data://preview:ID -> env["preview"][ID]
+    data = env
+    for key in keys:
+        try:
+            data = data[key]
+        except KeyError as err:
+            raise errors.ParseError("%s: parsing %s at line %s" % (err, src, line))
+    return data
+
+
+# Asset stores, `env` values serving `data://` keys without loading them
+
+class Blob(namedtuple("Blob", "key data")):
+    """
+    Stored asset, `data` is a buffer (es. a memoryview of a memory mapped
+    file) and `key` identifies its content in the caches, without hashing it.
+    """
+    __slots__ = ()
+
+
+def _map(fileobj, offset=0, size=None):
+    if size is None:
+        size = os.fstat(fileobj.fileno()).st_size - offset
+    if size == 0:
+        # empty files can't be mapped
+        return memoryview(b"")
+    # the map keeps its own handle, the file can be closed
+    mapped = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)[offset:offset + size]
+
+
+def _qbytes(data):
+    """
+    QByteArray of `data` without copies, valid while `data` is alive
+    """
+    if isinstance(data, memoryview):
+        return QByteArray.fromRawData(data)
+    return QByteArray(data)
+
+
+class DirectoryStore(object):
+    """
+    `env` value serving the files under `root`: with
+    `env = {"previews": DirectoryStore("previews/")}` the source
+    `data://previews:ID` is the file `previews/ID` (`data://previews:a:b` is
+    `previews/a/b`), returned as a memory mapped `Blob`.
+    """
+    def __init__(self, root):
+        self.root = root
+
+    def __getitem__(self, key):
+        # a single name, nothing outside `root` can be reached
+        separators = [sep for sep in (os.sep, os.altsep) if sep]
+        if (key in ("", os.curdir, os.pardir) or any(sep in key for sep in separators) or
+                os.path.isabs(key) or os.path.splitdrive(key)[0]):
+            raise KeyError(key)
+        path = os.path.join(self.root, key)
+        if os.path.isdir(path):
+            return DirectoryStore(path)
+        try:
+            with open(path, "rb") as fileobj:
+                stat = os.fstat(fileobj.fileno())
+                data = _map(fileobj)
+        except (IOError, OSError):
+            raise KeyError(key)
+        return Blob(("path", os.path.abspath(path), stat.st_mtime, stat.st_size), data)
+
+
+class ArchiveStore(object):
+    """
+    `env` value serving the members of the zip archive `path`, with
+    `env = {"previews": ArchiveStore("previews.zip")}` the source
+    `data://previews:ID` is the member `ID` (`data://previews:a:b` is
+    `a/b`). The archive is memory mapped once, stored (not compressed)
+    members are returned as `Blob` slices of the map, without copies,
+    compressed ones are read.
+
+    Stores are pickled by path, each process maps the file again, so
+    workers share the same pages.
+    """
+    def __init__(self, path, prefix=""):
+        self.path = path
+        self.prefix = prefix
+        self._open()
+
+    def _open(self):
+        with open(self.path, "rb") as fileobj:
+            stat = os.fstat(fileobj.fileno())
+            self._map = _map(fileobj)
+        self._id = ("archive", os.path.abspath(self.path), stat.st_mtime, stat.st_size)
+        with zipfile.ZipFile(self.path) as archive:
+            self._members = dict((info.filename, info) for info in archive.infolist())
+        self._dirs = set()
+        for name in self._members:
+            parts = name.split("/")[:-1]
+            for i in range(1, len(parts) + 1):
+                self._dirs.add("/".join(parts[:i]))
+
+    def _data(self, info):
+        if info.compress_type != zipfile.ZIP_STORED:
+            with zipfile.ZipFile(self.path) as archive:
+                return archive.read(info)
+        # data follows the local file header, 30 bytes + name + extra field
+        offset = info.header_offset
+        name_size, extra_size = struct.unpack("<HH", self._map[offset + 26:offset + 30])
+        offset += 30 + name_size + extra_size
+        return self._map[offset:offset + info.file_size]
+
+    def __getitem__(self, key):
+        name = self.prefix + key
+        info = self._members.get(name)
+        if info is not None:
+            return Blob(self._id + (name,), self._data(info))
+        if name in self._dirs:
+            view = ArchiveStore.__new__(ArchiveStore)
+            view.__dict__.update(self.__dict__)
+            view.prefix = name + "/"
+            return view
+        raise KeyError(key)
+
+    def __getstate__(self):
+        return {"path": self.path, "prefix": self.prefix}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+
+def write_archive(path, assets):
+    """
+    Write the `assets` mapping (name -> bytes) in a zip archive for
+    `ArchiveStore`, members are stored, so they can be mapped.
+    """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        for name, data in assets.items():
+            archive.writestr(name, data)
+
+
+# parsed svgs shared by all the widgets and reports of the process, bounded
+# by the size of the svg sources
+svg_cache = LRUCache(256, maxbytes=32 * 1024 * 1024)
+
+
+def _svg_source(src, env, line):
+    """
+    `(key, nbytes, data)` of the svg `src`, `data` is None for files
+    """
+    if src.startswith("data://"):
+        data = resolve_data(env, src, line)
+        if isinstance(data, Blob):
+            key, data = data.key, data.data
+            return key, len(data), data
+        # the svg source as text, or any buffer (bytes, bytearray,
+        # memoryview, QByteArray, ...) hashed and loaded without copies
+        if isinstance(data, type(u"")):
+            data = data.encode("utf-8")
+        elif isinstance(data, QByteArray):
+            data = bytes(data)
+        try:
+            buf = memoryview(data)
+        except TypeError:
+            raise errors.TagError("Invalid svg data in src='%s' at line %s" % (src, line))
+        return ("sha1", hashlib.sha1(buf).hexdigest()), buf.nbytes, buf
+    try:
+        stat = os.stat(src)
+    except OSError:
+        raise errors.TagError("Missing svg in src='%s' at line %s" % (src, line))
+    return ("path", os.path.abspath(src), stat.st_mtime, stat.st_size), stat.st_size, None
+
+
+def _load_svg(src, data):
+    profiler = profiling.active
+    if profiler is not None:
+        start = profiling.clock()
+    # no parent, shared renderers outlive the widgets
+    renderer = QSvgRenderer(_qbytes(data) if data is not None else src)
+    app = QCoreApplication.instance()
+    if app is not None and renderer.thread() is not app.thread():
+        # parsed by a prefetch, used by the GUI thread
+        renderer.moveToThread(app.thread())
+    if profiler is not None:
+        profiler.record("svg", start, "svg")
+    return renderer
+
+
+def _cache_put(cache, key, value, nbytes):
+    if isinstance(cache, LRUCache):
+        cache.put(key, value, nbytes)
+    else:
+        cache[key] = value
+
+
+def _prefetch_svg(src, line):
+    # runs in the pool, the renderer goes straight to the bounded cache
+    key, nbytes, _ = _svg_source(src, None, line)
+    if key not in svg_cache:
+        renderer = _load_svg(src, None)
+        if renderer.isValid():
+            svg_cache.put(key, renderer, nbytes)
+    return key, nbytes
+
+
+def svg_renderer(src, env, line, cache=None):
+    """
+    QSvgRenderer of `src` (a path or a `data://` source), taken from `cache`
+    (a dict or an LRUCache, by default `svg_cache`) if already parsed. Files
+    are keyed by path and mtime, data by content hash; files prefetched by
+    `prefetch_assets` are not looked up again.
+    """
+    if cache is None:
+        cache = svg_cache
+    prefetched = None
+    if not src.startswith("data://"):
+        prefetched = _prefetched(("svg", os.path.abspath(src)))
+    if prefetched is not None:
+        key, nbytes = prefetched
+        data = None
+    else:
+        key, nbytes, data = _svg_source(src, env, line)
+    renderer = cache.get(key)
+    if renderer is not None:
+        return renderer
+    if prefetched is not None and cache is not svg_cache:
+        renderer = svg_cache.get(key)
+    if renderer is None:
+        renderer = _load_svg(src, data)
+    if not renderer.isValid():
+        raise errors.TagError("Invalid svg in src='%s' at line %s" % (src, line))
+    _cache_put(cache, key, renderer, nbytes)
+    return renderer
+
+
+# decoded and scaled images, as QImage (QPixmap can't leave the GUI thread),
+# bounded by their pixel data size
+image_cache = LRUCache(4096, maxbytes=256 * 1024 * 1024)
+
+_decoder = None
+# prefetch request -> AsyncResult of the cache key of its result, the
+# results themselves are in the caches; entries live until the widgets of
+# the prefetching build are done (see `release_prefetched`)
+_pending = {}
+_pending_lock = threading.Lock()
+
+# key of a missing file
+_MISSING = "missing"
+
+
+def _decoder_pool():
+    global _decoder
+    with _pending_lock:
+        if _decoder is None:
+            _decoder = ThreadPool(multiprocessing.cpu_count())
+        return _decoder
+
+
+def _submit(request, func, *args):
+    """
+    Run `func(*args)` on the decoder pool unless `request` is already
+    pending, returns True if it was submitted.
+    """
+    pool = _decoder_pool()
+    with _pending_lock:
+        if request in _pending:
+            return False
+        _pending[request] = pool.apply_async(func, args)
+        return True
+
+
+def _prefetched(request):
+    """
+    Wait for the pending `request`, returns its result (None if not
+    submitted)
+    """
+    with _pending_lock:
+        result = _pending.get(request)
+    return result.get() if result is not None else None
+
+
+def release_prefetched(requests):
+    """
+    Forget the `requests` returned by `prefetch_assets`, their results stay
+    in the caches
+    """
+    with _pending_lock:
+        for request in requests:
+            _pending.pop(request, None)
+
+
+def _scale(image, width, height):
+    if image.isNull():
+        return image
+    if width is not None and height is not None:
+        image = image.scaled(width, height, transformMode=Qt.SmoothTransformation)
+    elif width is not None:
+        image = image.scaledToWidth(width, mode=Qt.SmoothTransformation)
+    elif height is not None:
+        image = image.scaledToHeight(height, mode=Qt.SmoothTransformation)
+    return image
+
+
+# QImage formats of (height, width, channels) uint8 pixel arrays, RGBA8888
+# needs Qt >= 5.2
+_PIXEL_FORMATS = {3: QImage.Format_RGB888}
+if getattr(QImage, "Format_RGBA8888", None) is not None:
+    _PIXEL_FORMATS[4] = QImage.Format_RGBA8888
+
+def _decode_pixels(pixels, width, height):
+    rows, columns, channels = pixels.shape
+    image = QImage(memoryview(pixels), columns, rows, pixels.strides[0], _PIXEL_FORMATS[channels])
+    scaled = _scale(image, width, height)
+    # the image still points to the array memory if not scaled
+    return scaled.copy() if scaled is image else scaled
+
+
+def _image_job(src, width, height, env=None, line=None):
+    """
+    `(key, decode)` for the image `src`, `decode()` returns the scaled
+    QImage and `key` identifies it in `image_cache` (None if it can't be
+    cached).
+
+    A `data://` source can resolve to a QImage, a `Blob`, the encoded image
+    as bytes or any buffer (memoryview, 1d numpy array, ...), or a numpy
+    like (height, width, 3 or 4) uint8 array of RGB(A) pixels, used without
+    copies.
+    """
+    if not src.startswith("data://"):
+        try:
+            stat = os.stat(src)
+        except OSError:
+            return None, QImage
+        key = ("path", os.path.abspath(src), stat.st_mtime, stat.st_size, width, height)
+        return key, lambda: _scale(QImage(src), width, height)
+    data = resolve_data(env, src, line)
+    if isinstance(data, QImage):
+        return None, lambda: _scale(data, width, height)
+    key = None
+    if isinstance(data, Blob):
+        key, data = data.key, data.data
+    try:
+        if hasattr(data, "dtype") and len(data.shape) == 3:
+            buf = memoryview(data)
+            if data.shape[2] not in _PIXEL_FORMATS or data.dtype.itemsize != 1 or not buf.c_contiguous:
+                raise errors.TagError("Unsupported pixels %s %s in src='%s' at line %s"
+                                      % (data.shape, data.dtype, src, line))
+            decode = lambda: _decode_pixels(data, width, height)
+            shape = data.shape
+        else:
+            buf = memoryview(data)
+            decode = lambda: _scale(QImage.fromData(_qbytes(buf)), width, height)
+            shape = None
+    except TypeError:
+        raise errors.TagError("Invalid image data in src='%s' at line %s" % (src, line))
+    if key is None:
+        key = ("sha1", hashlib.sha1(buf).hexdigest(), shape)
+    return key + (width, height), decode
+
+
+def _image_size(attrs):
+    width, height = attrs.get("width"), attrs.get("height")
+    return (int(width) if width is not None else None,
+            int(height) if height is not None else None)
+
+
+def _cache_image(key, image):
+    if not image.isNull():
+        image_cache.put(key, image, image.bytesPerLine() * image.height())
+
+
+def _prefetch_image(src, width, height):
+    # runs in the pool, the image goes straight to the bounded cache
+    key, decode = _image_job(src, width, height)
+    if key is None:
+        return _MISSING
+    if key not in image_cache:
+        _cache_image(key, decode())
+    return key
+
+
+def _prefetch_data_image(src, width, height, env, line):
+    # runs in the pool: the data is resolved, hashed and decoded here
+    key, decode = _image_job(src, width, height, env, line)
+    if key is not None and key not in image_cache:
+        _cache_image(key, decode())
+    return key
+
+
+def _image_request(src, width, height, env):
+    if src.startswith("data://"):
+        # `env` is alive while its requests are pending
+        return ("data", src, id(env), width, height)
+    return ("image", os.path.abspath(src), width, height)
+
+
+def scaled_image(src, width=None, height=None, env=None, line=None):
+    """
+    QImage of `src` (a file or a `data://` source resolved in `env`, see
+    `_image_job`) scaled to `width` and/or `height`, from `image_cache` (or
+    a pending `prefetch_assets` decode), decoded here otherwise. A null
+    QImage is returned for missing or invalid files.
+    """
+    key = _prefetched(_image_request(src, width, height, env))
+    if key is _MISSING:
+        return QImage()
+    if key is not None:
+        image = image_cache.get(key)
+        if image is not None:
+            return image
+    key, decode = _image_job(src, width, height, env, line)
+    if profiling.active is not None:
+        decode = profiling.active.wrap("image", decode, "image")
+    if key is None:
+        return decode()
+    image = image_cache.get(key)
+    if image is None:
+        image = decode()
+        _cache_image(key, image)
+    return image
+
+
+def prefetch_assets(template, env=None):
+    """
+    Start loading the images and svgs of the compiled `template` (or of an
+    `Element` subtree) on a background thread pool, into `image_cache` and
+    `svg_cache`. Files are looked up, read and decoded there, so building
+    the widgets doesn't wait on the disk (or the network share). `data://`
+    images are decoded too if `env` is given.
+
+    Returns the requests started, pass them to `release_prefetched` once
+    the widgets are built.
+    """
+    profiler = profiling.active
+    requests = []
+    stack = [getattr(template, "root", template)]
+    while stack:
+        element = stack.pop()
+        stack.extend(element.children)
+        if element.tag not in ("image", "svg"):
+            continue
+        attrs = dict(element.attrs)
+        src = attrs.get("src", "")
+        if element.tag == "svg":
+            if src.startswith("data://"):
+                continue
+            request, job, args = ("svg", os.path.abspath(src)), _prefetch_svg, (src, element.line)
+        else:
+            width, height = _image_size(attrs)
+            if not src.startswith("data://"):
+                job, args = _prefetch_image, (src, width, height)
+            elif env is not None:
+                job, args = _prefetch_data_image, (src, width, height, env, element.line)
+            else:
+                continue
+            request = _image_request(src, width, height, env)
+            if profiler is not None:
+                job = profiler.wrap("image", job, "image")
+        if _submit(request, job, *args):
+            requests.append(request)
+    return requests
@@ -0,0 +1,76 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+from __future__ import print_function, absolute_import, division
+
+import threading
+from collections import OrderedDict, namedtuple
+
+__all__ = ["LRUCache", "CacheInfo"]
+
+
+CacheInfo = namedtuple("CacheInfo", "hits misses maxsize currsize")
+
+
+class LRUCache(object):
+    """
+    Thread safe least recently used mapping, used to share expensive objects
+    (compiled templates, rendered text, ...) between `parse` calls.
+
+    `maxsize` is the maximum number of entries kept, `maxbytes` (if given)
+    bounds the sum of the `nbytes` passed to `put`, the least recently used
+    entries are evicted first.
+    """
+    def __init__(self, maxsize=128, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.currbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            # move on top, as most recently used
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value, nbytes=0):
+        with self._lock:
+            if key in self._data:
+                del self._data[key]
+                self.currbytes -= self._sizes.pop(key)
+            self._data[key] = value
+            self._sizes[key] = nbytes
+            self.currbytes += nbytes
+            while self._data and (len(self._data) > self.maxsize or
+                                  self.maxbytes is not None and self.currbytes > self.maxbytes):
+                old_key, _ = self._data.popitem(last=False)
+                self.currbytes -= self._sizes.pop(old_key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.currbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+"""
+Display lists, rendered pages saved for later replay.
+
+A `DisplayList` keeps the QPicture of each printed page with its size and
+the `metadata` of its section. Saved to disk (a zip with an `index.json`
+and a picture for each page) it can be printed, rasterized or previewed
+again without parsing the template or laying out the widgets:
+
+    DisplayList.record(parse(open("invoice.wrp"))).save("invoice.wrd")
+    ...
+    display_list = DisplayList.load("invoice.wrd")
+    display_list.print_to(pdf_writer("invoice.pdf"))
+"""
+from __future__ import print_function, absolute_import, division
+
+import json
+import zipfile
+from collections import namedtuple
+
+try:
+    from PyQt5.QtGui import QPainter
+    from PyQt5.QtPrintSupport import QPrinter, QPrintPreviewDialog
+except ImportError:
+    from PyQt4.QtGui import QPainter, QPrinter, QPrintPreviewDialog
+
+from . import errors
+from .parser import TextViewer
+from .painter import pdf_printer, picture_data, load_picture, _iter_page_widgets, _page_rect
+from .raster import _record_page, _rasterize, _pipeline
+
+__all__ = ["DisplayList", "RecordedPage"]
+
+FORMAT_VERSION = 1
+
+_INDEX = "index.json"
+
+
+class RecordedPage(namedtuple("RecordedPage", "data width height section metadata")):
+    """
+    A printed page, `data` is the QPicture (see `painter.picture_data`) of
+    a `width` x `height` page (in the recording printer device pixels),
+    `section` the index of the section it belongs to and `metadata` the
+    section metadata.
+    """
+    __slots__ = ()
+
+    def picture(self):
+        return load_picture(self.data)
+
+
+class DisplayList(object):
+    """
+    The recorded pages of a report, painted at `resolution` dpi.
+    """
+    def __init__(self, pages=(), resolution=None):
+        self.pages = list(pages)
+        self.resolution = resolution
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    @classmethod
+    def record(cls, pages, printer=None, unit=QPrinter.DevicePixel):
+        """
+        Paint the `pages` (widgets or `LazyPage`s) as they would be printed
+        on `printer` (by default a `pdf_printer`) and record them.
+        """
+        if printer is None:
+            printer = pdf_printer()
+        page_rect = _page_rect(printer, unit)
+        width, height = page_rect.width(), page_rect.height()
+        recorded = []
+        section = -1
+        for widget in _iter_page_widgets(pages):
+            if not isinstance(widget, TextViewer):
+                section += 1
+            picture = _record_page(widget, page_rect)
+            # text continuation pages belong to the section window
+            metadata = getattr(widget.window(), "metadata", None)
+            recorded.append(RecordedPage(picture_data(picture), width, height, section, metadata))
+        return cls(recorded, printer.resolution())
+
+    def save(self, target):
+        """
+        Write the display list to `target`, a filename or a binary file
+        """
+        index = {
+            "version": FORMAT_VERSION,
+            "resolution": self.resolution,
+            "pages": [],
+        }
+        with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as archive:
+            for num, page in enumerate(self.pages):
+                name = "pages/%05d.pic" % num
+                archive.writestr(name, page.data)
+                index["pages"].append({"picture": name, "width": page.width, "height": page.height,
+                                       "section": page.section, "metadata": page.metadata})
+            archive.writestr(_INDEX, json.dumps(index, indent=1, sort_keys=True))
+
+    @classmethod
+    def load(cls, source):
+        """
+        Read a display list written by `save`, `source` is a filename or a
+        binary file.
+        """
+        try:
+            with zipfile.ZipFile(source) as archive:
+                index = json.loads(archive.read(_INDEX).decode("utf-8"))
+                if index.get("version") != FORMAT_VERSION:
+                    raise errors.RenderError("unsupported display list version %r"
+                                             % index.get("version"))
+                pages = [RecordedPage(archive.read(page["picture"]), page["width"], page["height"],
+                                      page["section"], page["metadata"])
+                         for page in index["pages"]]
+        except (zipfile.BadZipfile, KeyError, ValueError) as err:
+            raise errors.RenderError("invalid display list: %s" % err)
+        return cls(pages, index["resolution"])
+
+    def print_to(self, printer):
+        """
+        Replay the pages on `printer` (or a `pdf_writer`), scaled if its
+        resolution is not the recorded one.
+        """
+        scale = printer.resolution() / self.resolution
+        painter = QPainter(printer)
+        try:
+            for num, page in enumerate(self.pages):
+                if num > 0:
+                    printer.newPage()
+                painter.save()
+                painter.scale(scale, scale)
+                painter.drawPicture(0, 0, page.picture())
+                painter.restore()
+        finally:
+            painter.end()
+
+    def render_images(self, dpi=150, thumbnail=None, threads=None):
+        """
+        Rasterize the pages at `dpi` or, if `thumbnail` is a `(width,
+        height)`, fitted in it. Yields a QImage for each page, in order,
+        see `raster.render_images`.
+        """
+        def jobs():
+            for page in self.pages:
+                if thumbnail is not None:
+                    scale = min(thumbnail[0] / page.width, thumbnail[1] / page.height)
+                else:
+                    scale = dpi / self.resolution
+                yield page.data, page.width, page.height, scale
+        return _pipeline(_rasterize, jobs(), threads)
+
+    def preview(self, printer=None, parent=None):
+        """
+        A QPrintPreviewDialog showing the pages, call its `exec_()`
+        """
+        if printer is None:
+            printer = pdf_printer()
+        dialog = QPrintPreviewDialog(printer, parent)
+        dialog.paintRequested.connect(self.print_to)
+        return dialog
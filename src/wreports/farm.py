@@ -0,0 +1,162 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+"""
+Multiprocess render farm.
+
+Qt widgets live in the GUI thread, so a single process renders one report at
+a time. `RenderFarm` spreads (template, env) jobs on a pool of worker
+processes, each one with its own offscreen QApplication and its own caches,
+warmed up with the given templates:
+
+    with RenderFarm(processes=8, templates=["invoice.wrp"]) as farm:
+        for pdf in farm.map("invoice.wrp", envs):
+            ...
+
+Templates are passed as paths (or xml sources), `env` must be picklable.
+"""
+from __future__ import print_function, absolute_import, division
+
+import io
+import os
+import tempfile
+import multiprocessing
+
+from .template import compile_template, load_template, string_types
+
+__all__ = ["RenderFarm"]
+
+
+# worker side
+
+_app = None
+
+def _template(template):
+    if isinstance(template, string_types) and os.path.isfile(template):
+        return load_template(template)
+    return compile_template(template)
+
+def _init_worker(templates):
+    global _app
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5.QtWidgets import QApplication
+    except ImportError:
+        from PyQt4.QtGui import QApplication
+    _app = QApplication.instance() or QApplication([])
+    for template in templates:
+        _template(template)
+
+def _render(template, env, output):
+    from .parser import build
+    from .painter import pdf_printer, pdf_writer, iter_paint_pages, picture_data
+    pages = build(_template(template), env, lazy=True)
+    if output == "pictures":
+        printer = pdf_printer(os.devnull)
+        return [picture_data(picture) for picture in iter_paint_pages(printer, pages, pictures=True)]
+    if output == "displaylist":
+        from .displaylist import DisplayList
+        data = io.BytesIO()
+        DisplayList.record(pages).save(data)
+        return data.getvalue()
+    fd, filename = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    try:
+        for _ in iter_paint_pages(pdf_writer(filename), pages):
+            pass
+        with open(filename, "rb") as pdf:
+            return pdf.read()
+    finally:
+        os.remove(filename)
+
+def _render_job(args):
+    return _render(*args)
+
+
+# values of `output`, see `RenderFarm`
+_OUTPUTS = ("pdf", "pictures", "displaylist")
+
+def _check_output(output):
+    if output not in _OUTPUTS:
+        raise ValueError("unknown output %r, use one of %s" % (output, ", ".join(_OUTPUTS)))
+
+
+# public api
+
+class RenderFarm(object):
+    """
+    Pool of `processes` render workers (default: one per core), each worker
+    is replaced after `maxtasksperchild` jobs to contain leaks.
+
+    Jobs return the pdf as bytes (`output="pdf"`) or the page QPictures data
+    (`output="pictures"`, load them back with `painter.load_picture`) or a
+    saved `DisplayList` (`output="displaylist"`), any other `output` raises
+    ValueError.
+    """
+    def __init__(self, processes=None, maxtasksperchild=100, templates=()):
+        if hasattr(multiprocessing, "get_context"):
+            # a forked Qt is not safe, workers start from a clean interpreter
+            context = multiprocessing.get_context("spawn")
+        else:
+            context = multiprocessing
+        self._context = context
+        self._maxtasksperchild = maxtasksperchild
+        self._templates = tuple(templates)
+        self.processes = processes or multiprocessing.cpu_count()
+        self._pool = self._start()
+
+    def _start(self):
+        return self._context.Pool(self.processes,
+                                  initializer=_init_worker,
+                                  initargs=(self._templates,),
+                                  maxtasksperchild=self._maxtasksperchild)
+
+    def submit(self, template, env=None, output="pdf", callback=None, error_callback=None):
+        """
+        Queue a job, returns a `multiprocessing.pool.AsyncResult`
+        """
+        _check_output(output)
+        kwargs = {"callback": callback}
+        if error_callback is not None:
+            kwargs["error_callback"] = error_callback
+        return self._pool.apply_async(_render, (template, env, output), **kwargs)
+
+    def render(self, template, env=None, output="pdf"):
+        """
+        Render a single report, waiting for the result
+        """
+        return self.submit(template, env, output).get()
+
+    def map(self, template, envs, output="pdf", chunksize=1):
+        """
+        Render a report for each env in `envs`, yields the results in order
+        as soon as they are ready.
+        """
+        _check_output(output)
+        jobs = ((template, env, output) for env in envs)
+        return self._pool.imap(_render_job, jobs, chunksize)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+
+    def restart(self):
+        """
+        Kill the workers, even if busy (es. on a job that never ends), and
+        start new ones. The queued and running jobs are lost, their results
+        never come.
+        """
+        self.terminate()
+        self._pool = self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -0,0 +1,552 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+"""
+Widget free rendering backend.
+
+Lays out a compiled template with lightweight boxes and paints them directly
+on a QPainter (a printer, a QPdfWriter, a QPicture, ...). No QWidget is ever
+created, so a QGuiApplication is enough, even on the offscreen platform:
+
+    app = QGuiApplication([])
+    pages = headless.parse(open("report.wrp", "rb"), env)
+    headless.paint_pages(printer, pages)
+
+The layout approximates the QBoxLayout one of `parser.build`: fixed size
+items (`size`, lines, labels) take their size, the others share the
+remaining space according to their stretch, fixed items smaller than their
+cell are centered. Sizes are in device pixels of the target page.
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+import re
+
+try:
+    from PyQt5.Qt import Qt
+    from PyQt5.QtCore import QRectF, QSizeF, QLineF, QByteArray
+    from PyQt5.QtGui import QPainter, QTextDocument, QImage, QFont, QPen, QColor
+    from PyQt5.QtSvg import QSvgRenderer
+    from PyQt5.QtPrintSupport import QPrinter
+except ImportError:
+    from PyQt4.Qt import Qt
+    from PyQt4.QtCore import QRectF, QSizeF, QLineF, QByteArray
+    from PyQt4.QtGui import QPainter, QTextDocument, QImage, QFont, QPen, QColor, QPrinter
+    from PyQt4.QtSvg import QSvgRenderer
+
+from . import errors
+from . import profiling
+from .template import compile_template
+from .markup import text_html, label_html, document_html
+from .assets import (svg_renderer, scaled_image, prefetch_assets, release_prefetched, _image_size,
+                     ERROR_SVG)
+
+__all__ = ["parse", "build", "paint_page", "paint_pages"]
+
+
+# Layout boxes
+
+class _Box(object):
+    """
+    Base layout box, `rect` is assigned by the parent layout.
+
+    `width_hint` and `height_hint` return the size the box wants, or None if
+    the box can grow and share the free space.
+    """
+    def __init__(self, name=None, size=None, hstretch=10, vstretch=10):
+        self.name = name
+        self.size = size
+        self.hstretch = int(hstretch)
+        self.vstretch = int(vstretch)
+        self.rect = QRectF()
+    def width_hint(self):
+        return self.size[0] if self.size else None
+    def height_hint(self, width):
+        return self.size[1] if self.size else None
+    def layout(self, rect):
+        self.rect = rect
+    def paint(self, painter):
+        pass
+    def boxes(self):
+        yield self
+
+
+class _LayoutBox(_Box):
+    """
+    <col> (vertical) or <row> (horizontal) container
+    """
+    def __init__(self, vertical, spacing=0, margins=(0, 0, 0, 0), stretch=10, name=None):
+        super(_LayoutBox, self).__init__(name=name, hstretch=stretch, vstretch=stretch)
+        self.vertical = vertical
+        self.spacing = spacing
+        self.margins = margins
+        self.children = []
+
+    def _inner(self, rect):
+        left, top, right, bottom = self.margins
+        return rect.adjusted(left, top, -right, -bottom)
+
+    def _spacing(self):
+        return self.spacing * max(0, len(self.children) - 1)
+
+    def width_hint(self):
+        hints = [child.width_hint() for child in self.children]
+        if not hints or None in hints:
+            return None
+        left, _, right, _ = self.margins
+        if self.vertical:
+            return max(hints) + left + right
+        return sum(hints) + self._spacing() + left + right
+
+    def height_hint(self, width):
+        left, top, right, bottom = self.margins
+        inner_width = width - left - right
+        if self.vertical:
+            hints = [child.height_hint(inner_width) for child in self.children]
+            if not hints or None in hints:
+                return None
+            return sum(hints) + self._spacing() + top + bottom
+        widths = self._distribute(inner_width, [c.width_hint() for c in self.children],
+                                  [c.hstretch for c in self.children])
+        hints = [child.height_hint(w) for child, w in zip(self.children, widths)]
+        # a row is as high as its tallest sized item, the others (vlines,
+        # svgs, ...) follow it
+        hints = [hint for hint in hints if hint is not None]
+        if not hints:
+            return None
+        return max(hints) + top + bottom
+
+    def _distribute(self, total, hints, stretches):
+        free = total - self.spacing * max(0, len(hints) - 1)
+        free -= sum(hint for hint in hints if hint is not None)
+        free = max(0, free)
+        flexible = [stretch for hint, stretch in zip(hints, stretches) if hint is None]
+        weights = sum(flexible)
+        sizes = []
+        for hint, stretch in zip(hints, stretches):
+            if hint is not None:
+                sizes.append(hint)
+            elif weights:
+                sizes.append(free * stretch / weights)
+            else:
+                sizes.append(free / len(flexible))
+        return sizes
+
+    def layout(self, rect):
+        self.rect = rect
+        inner = self._inner(rect)
+        if self.vertical:
+            hints = [child.height_hint(inner.width()) for child in self.children]
+            sizes = self._distribute(inner.height(), hints, [c.vstretch for c in self.children])
+            pos = inner.top()
+            for child, size in zip(self.children, sizes):
+                child.layout(_center(child, QRectF(inner.left(), pos, inner.width(), size)))
+                pos += size + self.spacing
+        else:
+            hints = [child.width_hint() for child in self.children]
+            sizes = self._distribute(inner.width(), hints, [c.hstretch for c in self.children])
+            pos = inner.left()
+            for child, size in zip(self.children, sizes):
+                child.layout(_center(child, QRectF(pos, inner.top(), size, inner.height())))
+                pos += size + self.spacing
+
+    def paint(self, painter):
+        for child in self.children:
+            child.paint(painter)
+
+    def boxes(self):
+        yield self
+        for child in self.children:
+            for box in child.boxes():
+                yield box
+
+
+def _center(box, cell):
+    """
+    Fixed size boxes smaller than their cell are centered, like QWidgetItem does
+    """
+    if not box.size:
+        return cell
+    width = min(box.size[0], cell.width())
+    height = min(box.size[1], cell.height())
+    return QRectF(cell.left() + (cell.width() - width) / 2,
+                  cell.top() + (cell.height() - height) / 2,
+                  width, height)
+
+
+class _LabelBox(_Box):
+    def __init__(self, html, font, word_wrap=False, **kwargs):
+        super(_LabelBox, self).__init__(**kwargs)
+        self.word_wrap = word_wrap
+        self.document = QTextDocument()
+        self.document.setUseDesignMetrics(True)
+        self.document.setDocumentMargin(0)
+        self.document.setDefaultFont(font)
+        self.document.setHtml(html)
+
+    def height_hint(self, width):
+        if self.size:
+            return self.size[1]
+        self.document.setTextWidth(width if self.word_wrap else -1)
+        return self.document.size().height()
+
+    def paint(self, painter):
+        self.document.setTextWidth(self.rect.width() if self.word_wrap else -1)
+        # vertically centered, as QLabel does
+        top = self.rect.top() + max(0, (self.rect.height() - self.document.size().height()) / 2)
+        painter.save()
+        painter.translate(self.rect.left(), top)
+        self.document.drawContents(painter, QRectF(0, 0, self.rect.width(), self.rect.height()))
+        painter.restore()
+
+
+class _TextBox(_Box):
+    """
+    Multipage markdown text, the first page is drawn in the box, each
+    following page fills a whole page (see `parser.TextViewer`).
+    """
+    def __init__(self, html, font, **kwargs):
+        super(_TextBox, self).__init__(**kwargs)
+        self.html = html
+        self.document = QTextDocument()
+        self.document.setUseDesignMetrics(True)
+        self.document.setDefaultFont(font)
+        self._page_size = None
+        self._offset_top = 0
+
+    def paginate(self, page_size):
+        # the document is laid out once per page size, with a top margin
+        # that leaves room for the boxes above the text on the first page
+        offset_top = page_size.height() - self.rect.height()
+        if self._page_size is not None and (page_size, offset_top) == (self._page_size, self._offset_top):
+            return
+        self._page_size = page_size
+        self._offset_top = offset_top
+        self.document.setPageSize(page_size)
+        self.document.setHtml(document_html(self.html or "", offset_top))
+
+    def pageCount(self):
+        return self.document.pageCount() if self.html else 1
+
+    def paint(self, painter):
+        if not self.html:
+            return
+        width = self._page_size.width()
+        painter.save()
+        painter.setClipRect(QRectF(self.rect.left(), self.rect.top(), width, self.rect.height()))
+        painter.translate(self.rect.left(), self.rect.top() - self._offset_top)
+        self.document.drawContents(painter, QRectF(0, self._offset_top, width, self.rect.height()))
+        painter.restore()
+
+    def paint_page(self, painter, num):
+        width, height = self._page_size.width(), self._page_size.height()
+        painter.save()
+        painter.setClipRect(QRectF(0, 0, width, height))
+        painter.translate(0, -num * height)
+        self.document.drawContents(painter, QRectF(0, num * height, width, height))
+        painter.restore()
+
+
+class _LineBox(_Box):
+    def __init__(self, vertical, line_width=1, color=None, **kwargs):
+        super(_LineBox, self).__init__(**kwargs)
+        self.vertical = vertical
+        self.line_width = line_width
+        self.color = color if color is not None else QColor("black")
+
+    def _thickness(self):
+        # QFrame lines are 3px wide with the default line width
+        return max(3, self.line_width)
+
+    def width_hint(self):
+        if self.vertical:
+            return self._thickness()
+        return super(_LineBox, self).width_hint()
+
+    def height_hint(self, width):
+        if not self.vertical:
+            return self._thickness()
+        return super(_LineBox, self).height_hint(width)
+
+    def paint(self, painter):
+        painter.save()
+        painter.setPen(QPen(self.color, self.line_width))
+        center = self.rect.center()
+        if self.vertical:
+            painter.drawLine(QLineF(center.x(), self.rect.top(), center.x(), self.rect.bottom()))
+        else:
+            painter.drawLine(QLineF(self.rect.left(), center.y(), self.rect.right(), center.y()))
+        painter.restore()
+
+
+class _SvgBox(_Box):
+    def __init__(self, renderer, keep_aspect=True, **kwargs):
+        super(_SvgBox, self).__init__(**kwargs)
+        self.renderer = renderer
+        self.keep_aspect = keep_aspect
+
+    def paint(self, painter):
+        if not self.keep_aspect:
+            self.renderer.render(painter, self.rect)
+            return
+        view_box = self.renderer.viewBox()
+        svg_width, svg_height = view_box.width(), view_box.height()
+        if svg_width == 0 or svg_height == 0:
+            return
+        rect = self.rect
+        if rect.width() / svg_width < rect.height() / svg_height:
+            height = rect.width() * svg_height / svg_width
+            target = QRectF(rect.left(), rect.top() + (rect.height() - height) / 2, rect.width(), height)
+        else:
+            width = rect.height() * svg_width / svg_height
+            target = QRectF(rect.left() + (rect.width() - width) / 2, rect.top(), width, rect.height())
+        self.renderer.render(painter, target)
+
+
+class _ImageBox(_Box):
+    def __init__(self, image, text, font, **kwargs):
+        super(_ImageBox, self).__init__(**kwargs)
+        self.image = image
+        self.text = text
+        self.font = font
+
+    def paint(self, painter):
+        if self.image.isNull():
+            if self.text:
+                painter.save()
+                painter.setFont(self.font)
+                painter.drawText(self.rect, Qt.AlignLeft | Qt.AlignVCenter, self.text)
+                painter.restore()
+            return
+        # left aligned and vertically centered, as QLabel does
+        top = self.rect.top() + (self.rect.height() - self.image.height()) / 2
+        painter.drawImage(int(self.rect.left()), int(top), self.image)
+
+
+# Tag functions, one for each <tag> found, return a box
+
+_FONT_SIZE = re.compile(r"font-size\s*:\s*([0-9.]+)\s*(pt|px)")
+
+def _style_font(style, font):
+    """
+    Only the font size of the `style` attribute is honored
+    """
+    match = _FONT_SIZE.search(style or "")
+    if match is None:
+        return font
+    font = QFont(font)
+    size, unit = float(match.group(1)), match.group(2)
+    if unit == "pt":
+        font.setPointSizeF(size)
+    else:
+        font.setPixelSize(int(size))
+    return font
+
+def _widget_args(attrs):
+    return dict(name=attrs.get("name"),
+                size=attrs.get("size"),
+                hstretch=attrs.get("hstretch", 10),
+                vstretch=attrs.get("vstretch", 10))
+
+def _col(element, attrs, env, font):
+    return _LayoutBox(True, spacing=attrs.get("spacing", 0), margins=attrs.get("margins", (0, 0, 0, 0)),
+                      stretch=attrs.get("stretch", 10), name=attrs.get("name"))
+
+def _row(element, attrs, env, font):
+    return _LayoutBox(False, spacing=attrs.get("spacing", 0), margins=attrs.get("margins", (0, 0, 0, 0)),
+                      stretch=attrs.get("stretch", 10), name=attrs.get("name"))
+
+def _label(element, attrs, env, font):
+    html = label_html(element.text) if element.text else ""
+    return _LabelBox(html, font, word_wrap=attrs.get("word_wrap") == "True", **_widget_args(attrs))
+
+def _text(element, attrs, env, font):
+    html = text_html(element.text) if element.text else None
+    return _TextBox(html, font, **_widget_args(attrs))
+
+def _hline(element, attrs, env, font):
+    return _LineBox(False, line_width=attrs.get("line_width", 1), color=attrs.get("color"),
+                    **_widget_args(attrs))
+
+def _vline(element, attrs, env, font):
+    return _LineBox(True, line_width=attrs.get("line_width", 1), color=attrs.get("color"),
+                    **_widget_args(attrs))
+
+def _svg(element, attrs, env, font):
+    src = attrs.get("src", "")
+    try:
+        renderer = svg_renderer(src, env, element.line)
+        keep_aspect = True
+    except (errors.TagError, errors.ParseError):
+        renderer = QSvgRenderer(QByteArray(ERROR_SVG))
+        keep_aspect = False
+    return _SvgBox(renderer, keep_aspect, **_widget_args(attrs))
+
+def _image(element, attrs, env, font):
+    src = attrs.get("src", "")
+    try:
+        image = scaled_image(src, *_image_size(attrs), env=env, line=element.line)
+    except (errors.TagError, errors.ParseError):
+        image = QImage()
+    text = os.path.basename(src) if image.isNull() and os.path.exists(src) else ""
+    return _ImageBox(image, text, font, **_widget_args(attrs))
+
+_BOXES = {
+    "col": _col,
+    "row": _row,
+    "label": _label,
+    "text": _text,
+    "hline": _hline,
+    "vline": _vline,
+    "svg": _svg,
+    "image": _image,
+}
+
+
+class Page(object):
+    """
+    A <section> laid out with boxes, printed on one page plus the pages
+    needed by its <text> elements.
+    """
+    def __init__(self, root, name=None, metadata=None):
+        self.root = root
+        self.name = name
+        self.metadata = metadata
+        self.texts = [box for box in root.boxes() if isinstance(box, _TextBox)]
+        self._size = None
+
+    def layout(self, size):
+        if self._size is not None and size == self._size:
+            return
+        profiler = profiling.active
+        if profiler is not None:
+            start = profiling.clock()
+        self._size = size
+        self.root.layout(QRectF(0, 0, size.width(), size.height()))
+        for text in self.texts:
+            text.paginate(size)
+        if profiler is not None:
+            profiler.record("layout", start, "section")
+
+    def pageCount(self):
+        return 1 + sum(text.pageCount() - 1 for text in self.texts)
+
+    def paint(self, painter, num=0):
+        """
+        Paint page `num` of the section, 0 is the section itself, the others
+        are the continuation pages of the <text> elements, in order.
+        """
+        profiler = profiling.active
+        if profiler is not None:
+            start = profiling.clock()
+        self._paint(painter, num)
+        if profiler is not None:
+            profiler.record("paint", start, "section" if num == 0 else "text")
+
+    def _paint(self, painter, num):
+        if num == 0:
+            self.root.paint(painter)
+            return
+        for text in self.texts:
+            if num < text.pageCount():
+                text.paint_page(painter, num)
+                return
+            num -= text.pageCount() - 1
+        raise IndexError("page %d out of range" % num)
+
+
+def _build_box(element, env, font):
+    attrs = dict(element.attrs)
+    font = _style_font(attrs.get("style"), font)
+    try:
+        factory = _BOXES[element.tag]
+    except KeyError:
+        raise errors.TagError("unknown tag <%s> at line %s" % (element.tag, element.line))
+    profiler = profiling.active
+    if profiler is not None:
+        start = profiling.clock()
+    box = factory(element, attrs, env, font)
+    if profiler is not None:
+        profiler.record("build", start, element.tag)
+    if element.children and not isinstance(box, _LayoutBox):
+        raise errors.TagError("<%s> at line %s cannot contain other tags" % (element.tag, element.line))
+    for child in element.children:
+        box.children.append(_build_box(child, env, font))
+    return box
+
+def _section(element, env):
+    attrs = dict(element.attrs)
+    child_layout = attrs.get("child_layout", "col")
+    if child_layout not in ("col", "row"):
+        msg = "Invalid value %r for `child_layout` at line %s, use %s"
+        raise errors.TagError(msg % (child_layout, element.line, "col|row"))
+    font = _style_font(attrs.get("style", "font-size: 10pt"), QFont())
+    root = _LayoutBox(child_layout == "col",
+                      spacing=attrs.get("spacing", 0),
+                      margins=attrs.get("margins", (0, 0, 0, 0)),
+                      name=attrs.get("name"))
+    for child in element.children:
+        root.children.append(_build_box(child, env, font))
+    return Page(root, attrs.get("name"), attrs.get("metadata"))
+
+
+# public api
+
+def build(template, env=None):
+    """
+    Lay out the sections of a compiled `template` (see `compile_template`),
+    returns a list of `Page`.
+    """
+    root = template.root
+    if "version" not in dict(root.attrs):
+        raise errors.TagError("missing version number in <report>")
+    if profiling.active is not None:
+        profiling.active.set_template(template)
+    requests = prefetch_assets(template, env)
+    try:
+        return [_section(element, env) for element in root.children if element.tag == "section"]
+    finally:
+        release_prefetched(requests)
+
+
+def parse(source, env=None):
+    """
+    Headless equivalent of `parser.parse`, returns a list of `Page`.
+    """
+    return build(compile_template(source), env)
+
+
+def _page_rect(device, unit):
+    if hasattr(device, "pageRect"):
+        return device.pageRect(unit)
+    return QRectF(0, 0, device.width(), device.height())
+
+
+def paint_page(painter, page, page_rect, num=0):
+    """
+    Paint page `num` of `page` (see `Page.paint`) on `painter`, in a
+    `page_rect` sized area.
+    """
+    page.layout(QSizeF(page_rect.width(), page_rect.height()))
+    page.paint(painter, num)
+
+
+def paint_pages(printer, pages, unit=QPrinter.DevicePixel):
+    """
+    Given a `printer` (or any paged device, like a QPdfWriter) and a list of
+    `pages`, paints them one per page. Returns the number of printed pages.
+    """
+    page_rect = _page_rect(printer, unit)
+    painter = QPainter(printer)
+    count = 0
+    try:
+        for page in pages:
+            page.layout(QSizeF(page_rect.width(), page_rect.height()))
+            for num in range(page.pageCount()):
+                # newPage before all pages after the first
+                if count > 0:
+                    printer.newPage()
+                page.paint(painter, num)
+                count += 1
+    finally:
+        painter.end()
+    return count
@@ -0,0 +1,134 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+from __future__ import print_function, absolute_import, division
+
+import hashlib
+import textwrap
+import threading
+
+import bbcode
+import mistune
+
+from . import profiling
+from .cache import LRUCache
+
+__all__ = ["render_cache"]
+
+
+# Markdown helpers
+
+class QTextEditRenderer(mistune.Renderer):
+    """
+    QTextEdit targetted renderer with:
+
+    - full width tables
+    - odd / even rows
+    - use cell `align` attribute instead of `style`
+    """
+    def __init__(self, *args, **kwargs):
+        super(QTextEditRenderer, self).__init__(*args, **kwargs)
+        self._even_odd = False
+    def reset(self):
+        """
+        Restart the odd / even rows alternation, call before each new document
+        """
+        self._even_odd = False
+    def table(self, header, body):
+        out = super(QTextEditRenderer, self).table(header, body)
+        return out.replace("<table>", '<table width="100%">', 1)
+    def table_row(self, content):
+        out = super(QTextEditRenderer, self).table_row(content)
+        if content.strip().startswith("<th>"):
+            cls = 'class="header"'
+        else:
+            cls = 'class="even"' if self._even_odd else 'class="odd"'
+            self._even_odd = not self._even_odd
+        out = out.replace("<tr>", "<tr %s>" % cls, 1)
+        return out
+    def table_cell(self, content, **flags):
+        if flags['header']:
+            tag = 'th'
+        else:
+            tag = 'td'
+        align = flags['align']
+        if not align:
+            return '<%s>%s</%s>\n' % (tag, content, tag)
+        return '<%s align="%s">%s</%s>\n' % (tag, align, content, tag)
+
+class _Renderers(threading.local):
+    """
+    bbcode and mistune instances reused across elements, mistune keeps the
+    parsing state in the instance, so each thread gets its own set.
+    """
+    def __init__(self):
+        # default bbcode parser change \n with <br> we force it to \n to avoid changes
+        # 'raplace_cosmetic' change symbols into ascii code for html and we don't want that too
+        self.bbcode = bbcode.Parser(newline='\n', replace_cosmetic=False)
+        self.text_renderer = QTextEditRenderer()
+        self.text = mistune.Markdown(self.text_renderer)
+        self.label = mistune.Markdown(escape=True)
+
+_renderers = _Renderers()
+
+def _text_to_html(text):
+    """
+    bbcode + markdown body of a <text> to html
+    """
+    renderers = _renderers
+    renderers.text_renderer.reset()
+    return renderers.text(renderers.bbcode.format(text))
+
+def _label_to_html(text):
+    """
+    markdown body of a <label> to html
+    """
+    return _renderers.label(text)
+
+
+# html of <text> and <label> bodies, keyed by content hash, boilerplate text
+# repeated in every section and report is converted only once; bounded by
+# the html length too, a few huge bodies can't pin the memory
+render_cache = LRUCache(maxsize=1024, maxbytes=16 * 1024 * 1024)
+
+def _cached_html(kind, text, convert):
+    key = (kind, hashlib.sha1(text.encode("utf-8")).hexdigest())
+    html = render_cache.get(key)
+    if html is None:
+        profiler = profiling.active
+        if profiler is not None:
+            start = profiling.clock()
+        html = convert(text)
+        if profiler is not None:
+            profiler.record("markup", start, kind)
+        render_cache.put(key, html, nbytes=len(html))
+    return html
+
+def text_html(body):
+    """
+    Html of the body of a <text> element
+    """
+    return _cached_html("text", textwrap.dedent(body).strip(), _text_to_html)
+
+def label_html(body):
+    """
+    Html of the body of a <label> element
+    """
+    return _cached_html("label", body.strip(), _label_to_html).strip()
+
+
+_DOCUMENT_CSS = textwrap.dedent("""
+<style type="text/css">
+    tr.header {background: #BBB}
+    tr.even {background: #CCC}
+    tr.odd {background: #FFF}
+    div.markdown {margin-top: %(margin)dpx}
+</style>
+""").strip()
+
+def document_html(html, margin):
+    """
+    Full document for a <text> `html` body, `margin` on top leaves room for
+    the widgets above the text on the first page.
+    """
+    css = _DOCUMENT_CSS % {"margin": margin}
+    return '%s\n<div class="markdown">%s<span>' % (css, html)
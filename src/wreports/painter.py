@@ -2,39 +2,249 @@
 # encoding: utf-8
 from __future__ import division, print_function, absolute_import
 
-from .parser import TextViewer
+import os
+import sys
+
+from . import profiling
+from .parser import TextViewer, LazyPage, build, page_widget
+from .template import Template, compile_template, load_template, string_types
 
 try:
-    from PyQt5.QtGui import QPicture, QPainter
+    from PyQt5.QtGui import QPicture, QPainter, QPdfWriter, QRegion
     from PyQt5.QtPrintSupport import QPrinter, QPrintDialog, QPrintPreviewDialog
-    from PyQt5.QtCore import QTimer
+    from PyQt5.QtCore import QTimer, QPoint, QRectF, QBuffer, QByteArray, QIODevice
     from PyQt5.QtWidgets import QWidget
 except ImportError:
     from PyQt4.Qt import *
+    # Qt4 has no QPdfWriter, pdf are always written through a QPrinter
+    QPdfWriter = None
 
-__all__ = ["paint_page"]
+__all__ = ["paint_page", "iter_paint_pages", "pdf_printer", "pdf_writer", "render_batch",
+           "picture_data", "load_picture"]
 
 
 # public api
 
-def paint_page(painter, page, page_rect):
+def paint_page(painter, page, page_rect, picture=True):
     """
     Given a `painter` and a `page` (a widget presumably created parsing a
-    wreport), renders the widget on the painter and returns a QPicture.
+    wreport, or a `LazyPage`), renders the widget on the painter and returns
+    a QPicture. With `picture=False` nothing is recorded (None is returned)
+    and devices other than printers (es. a `pdf_writer`) are painted
+    directly.
     """
+    page = page_widget(page)
+    profiler = profiling.active
+    if profiler is None:
+        page.resize(page_rect.toRect().width(), page_rect.toRect().height())
+        return _render_page(painter, page, page_rect, picture)
+    tag = "text" if isinstance(page, TextViewer) else "section"
+    start = profiling.clock()
+    page.resize(page_rect.toRect().width(), page_rect.toRect().height())
+    profiler.record("layout", start, tag)
+    start = profiling.clock()
+    try:
+        return _render_page(painter, page, page_rect, picture)
+    finally:
+        profiler.record("paint", start, tag)
+
+
+def _render_page(painter, page, page_rect, picture):
     # make qwidget output vectorial, rendering directly on a printer
-    # results in a raster image in the pdf
+    # results in a raster image in the pdf (QWidget.render goes through a
+    # pixmap for printers), so printers get a recorded QPicture, any other
+    # device (es. a QPdfWriter) is painted directly
+    if not picture and not isinstance(painter.device(), QPrinter):
+        page.render(painter, QPoint(), QRegion(), QWidget.DrawChildren)
+        return None
     page_pic = QPicture()
     wpainter = QPainter(page_pic)
 
     # set the BoundingRect of page_pic and the page size to page_rect
     page_pic.setBoundingRect(page_rect.toRect())
-    page.resize(page_rect.toRect().width(), page_rect.toRect().height())
 
     page.render(wpainter, flags=QWidget.DrawChildren)
     wpainter.end()
     painter.drawPicture(0, 0, page_pic)
-    return page_pic
+    return page_pic if picture else None
+
+
+def _page_rect(device, unit):
+    if isinstance(device, QPrinter):
+        return device.pageRect(unit)
+    return QRectF(0, 0, device.width(), device.height())
+
+
+def _iter_page_widgets(pages):
+    """
+    The widget to print on each page: the section, then its TextViewers
+    once for each of their following pages. `LazyPage`s are released after
+    their last page.
+    """
+    # with a list of `LazyPage`s the assets of the next one are loaded
+    # while the current one is painted
+    following = pages[1:] + [None] if isinstance(pages, list) else None
+    next_page = None
+    try:
+        for num, page in enumerate(pages):
+            if following is not None and isinstance(following[num], LazyPage):
+                if isinstance(page, LazyPage):
+                    page.prefetch()
+                next_page = following[num]
+                next_page.prefetch()
+            widget = page_widget(page)
+            yield widget
+            for text_viewer in _continuation_pages(widget):
+                yield text_viewer
+            if isinstance(page, LazyPage):
+                # painted, the widgets are not needed anymore
+                page.release()
+    finally:
+        # stopped early, the next page won't be built
+        if next_page is not None:
+            next_page.cancel_prefetch()
+
+
+def _continuation_pages(widget):
+    for text_viewer in widget.findChildren(TextViewer):
+        # continuation pages resize the viewer to the whole page
+        geometry = text_viewer.geometry()
+        for num_page in range(1, text_viewer.pageCount()):
+            text_viewer.setPageNumber(num_page)
+            yield text_viewer
+        # back on the first page, the pages can be painted again
+        text_viewer.setPageNumber(0)
+        text_viewer.setGeometry(geometry)
+
+
+def _iter_paint_pages(painter, printer, pages, unit, pictures=False, new_page=False):
+    page_rect = _page_rect(printer, unit)
+    for widget in _iter_page_widgets(pages):
+        # newPage before all pages after the first
+        if new_page:
+            printer.newPage()
+        new_page = True
+        yield paint_page(painter, widget, page_rect, pictures)
+
+
+def iter_paint_pages(printer, pages, unit=QPrinter.DevicePixel, pictures=False):
+    """
+    Streaming `paint_pages`, renders the `pages` on the `printer` (or a
+    `pdf_writer`) yielding for each printed page, as soon as it is painted,
+    its QPicture if `pictures` is True, None otherwise. Nothing is kept after
+    that, `LazyPage` widgets are released once painted, so memory stays flat
+    with any page count.
+
+    The printer is closed when the generator is exhausted (or closed).
+    """
+    painter = QPainter(printer)
+    try:
+        for picture in _iter_paint_pages(painter, printer, pages, unit, pictures):
+            yield picture
+    finally:
+        painter.end()
+
+
+def picture_data(picture):
+    """
+    The content of `picture` as bytes, `QPicture.data()` can't be used, it
+    stops at the first NUL byte
+    """
+    data = QByteArray()
+    buffer = QBuffer(data)
+    buffer.open(QIODevice.WriteOnly)
+    picture.save(buffer)
+    buffer.close()
+    return bytes(data)
+
+
+def load_picture(data):
+    """
+    QPicture from the bytes of `picture_data`
+    """
+    buffer = QBuffer()
+    buffer.setData(data)
+    buffer.open(QIODevice.ReadOnly)
+    picture = QPicture()
+    picture.load(buffer)
+    return picture
+
+
+def pdf_printer(filename=None):
+    """
+    A4 color printer with pdf output in `filename`
+    """
+    # FIXME: investigate why QPrinter.HighResolution doesn't work as expected
+    printer = QPrinter()
+    printer.setOutputFormat(QPrinter.PdfFormat)
+    if filename is not None:
+        printer.setOutputFileName(filename)
+    printer.setColorMode(QPrinter.Color)
+    printer.setPaperSize(QPrinter.A4)
+    #printer.setOrientation(QPrinter.Landscape)
+    return printer
+
+
+def pdf_writer(filename, printer=None):
+    """
+    QPdfWriter with the same page layout and resolution of `printer` (by
+    default a `pdf_printer`), pages painted on it stay vectorial without
+    the intermediate QPicture needed by printers.
+    """
+    if printer is None:
+        printer = pdf_printer()
+    if QPdfWriter is None:
+        printer.setOutputFileName(filename)
+        return printer
+    writer = QPdfWriter(filename)
+    writer.setPageLayout(printer.pageLayout())
+    writer.setResolution(printer.resolution())
+    return writer
+
+
+def render_batch(template, envs, output, printer=None, unit=QPrinter.DevicePixel):
+    """
+    Renders one report for each `env` in `envs` using the same `template`
+    (a path, a source or a compiled `Template`), compiled once. The printer
+    setup is shared by all the reports, the parsed svgs through the bounded
+    `svg_cache`.
+
+    `output` can be:
+
+    - a filename pattern, formatted with the report `index`, es.
+      "statement-{index}.pdf", or a callable `output(index, env)` returning
+      the filename: a pdf for each report is written with a `pdf_writer`
+      using the page setup of `printer` (by default an A4 `pdf_printer`)
+    - a printer (or a `pdf_writer`): all the reports are painted in the
+      same document
+
+    Generator, yields `(index, filename)` (filename is None in the single
+    document case) as soon as each report is done.
+    """
+    if not isinstance(template, Template):
+        if isinstance(template, string_types) and os.path.isfile(template):
+            template = load_template(template)
+        else:
+            template = compile_template(template)
+    if hasattr(output, "newPage"):
+        painter = QPainter(output)
+        try:
+            for index, env in enumerate(envs):
+                pages = build(template, env, lazy=True)
+                for _ in _iter_paint_pages(painter, output, pages, unit, new_page=index > 0):
+                    pass
+                yield index, None
+        finally:
+            painter.end()
+        return
+    if printer is None:
+        printer = pdf_printer()
+    for index, env in enumerate(envs):
+        filename = output(index, env) if callable(output) else output.format(index=index)
+        pages = build(template, env, lazy=True)
+        for _ in iter_paint_pages(pdf_writer(filename, printer), pages, unit):
+            pass
+        yield index, filename
 
 
 # demo code
@@ -44,43 +254,23 @@ def paint_pages(printer, pages, unit=QPrinter.DevicePixel):
     Given a `printer` and a list of `pages`, renders the widgets on the
     printer, one per page, and returns a list of QPictures.
     """
-    pictures = []
-    painter = QPainter(printer)
-    for i, page in enumerate(pages):
-        # newPage before all pages after the first
-        if i > 0:
-            printer.newPage()
-        pictures.append(paint_page(painter, page, printer.pageRect(unit)))
-        for text_viewer in page.findChildren(TextViewer):
-            for num_page in range(1, text_viewer.pageCount()):
-                printer.newPage()
-                text_viewer.setPageNumber(num_page)
-                pictures.append(paint_page(painter, text_viewer, printer.pageRect(unit)))
-    painter.end()
-    return pictures
+    return list(iter_paint_pages(printer, pages, unit, pictures=True))
 
 
 def demo(template, preview=True):
-    import os
     from os.path import dirname, basename
     import parser
     app = QApplication([])
 
     print("Setup printer...")
-    # FIXME: investigate why QPrinter.HighResolution doesn't work as expected
-    printer = QPrinter()
-    printer.setOutputFormat(QPrinter.PdfFormat)
-    printer.setOutputFileName("report.pdf")
-    printer.setColorMode(QPrinter.Color)
-    printer.setPaperSize(QPrinter.A4)
-    #printer.setOrientation(QPrinter.Landscape)
+    printer = pdf_printer("report.pdf")
 
     def print_pages(requested_printer):
         print("Parsing template")
         current_dir = os.getcwd()
         template_dir = dirname(template)
         os.chdir(template_dir)
-        pages = parser.parse(open(basename(template)))
+        pages = parser.parse(open(basename(template)), lazy=True)
         paint_pages(requested_printer, pages)
         os.chdir(current_dir)
 
@@ -99,8 +289,6 @@ def demo(template, preview=True):
 
 
 if __name__ == '__main__':
-    import os
-    import sys
     if sys.argv[1:] and os.path.exists(sys.argv[1]):
         template = sys.argv[1]
         print("Parsing template %s" % template)
@@ -2,29 +2,34 @@
 # encoding: utf-8
 from __future__ import print_function, absolute_import, division
 
-import xml.parsers.expat
 import sys
 import os
-import textwrap
-
-import bbcode
-import mistune
+import logging
 
 try:
     from PyQt5.Qt import Qt
     from PyQt5.QtCore import (QSize, QSizeF, QByteArray, QRectF)
-    from PyQt5.QtGui import (QPixmap, QPainter, QColor, QTextDocument)
+    from PyQt5.QtGui import (QPixmap, QImage, QPainter, QColor, QTextDocument)
     from PyQt5.QtWidgets import (QVBoxLayout, QHBoxLayout, QWidget, QLabel, QFrame,
                              QSizePolicy, QApplication)
     from PyQt5.QtSvg import QSvgWidget
 except ImportError:
     from PyQt4.Qt import Qt
     from PyQt4.QtCore import (QSize, QSizeF, QByteArray, QRectF)
-    from PyQt4.QtGui import (QVBoxLayout, QHBoxLayout, QSizePolicy, QPixmap, QPainter,
+    from PyQt4.QtGui import (QVBoxLayout, QHBoxLayout, QSizePolicy, QPixmap, QImage, QPainter,
                              QColor, QApplication, QWidget, QLabel, QTextDocument, QFrame)
     from PyQt4.QtSvg import QSvgWidget
 
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
+
 from . import errors
+from . import profiling
+from .template import Template, compile_template, iter_sections
+from .markup import text_html, label_html, document_html
+from .assets import svg_renderer, scaled_image, prefetch_assets, release_prefetched, ERROR_SVG
 
 PY3 = sys.version_info.major == 3
 if PY3:
@@ -32,7 +37,9 @@ if PY3:
 else:
     from types import StringTypes as string_types
 
-__all__ = ["parse"]
+__all__ = ["parse", "iterparse", "build", "LazyPage", "Report"]
+
+log = logging.getLogger(__name__)
 
 def formatError(d):
     error =""
@@ -104,8 +111,7 @@ def _set_widget(widget,
         widget.setSizePolicy(policy)
     if size is not None:
         qsize = QSize(*size)
-        if __debug__:
-            print("Setting sizeHint to %s" % qsize)
+        log.debug("Setting sizeHint to %s", qsize)
         widget.sizeHint = lambda: qsize
         widget.setMinimumSize(qsize)
         widget.setMaximumSize(qsize)
@@ -229,6 +235,10 @@ def _label(widget=None,
 
 
 class TextViewer(QWidget):
+    """
+    Multipage markdown text, the document is laid out once per page size,
+    painting a page only draws the part of the document visible in it.
+    """
     def __init__(self, page, *args, **kwargs):
         self.page = page
 
@@ -237,6 +247,8 @@ class TextViewer(QWidget):
         self._document.setUseDesignMetrics(True)
         self._page_number = 0
         self.__offset_top = 0
+        self._html = None
+        self._html_key = None
     def document(self):
         return self._document
     def setHtml(self, html):
@@ -248,43 +260,46 @@ class TextViewer(QWidget):
             self.__offset_top = self.page.height() - self.height()
         return self.__offset_top
     def _updateHtml(self):
-        css = textwrap.dedent("""
-        <style type="text/css">
-            tr.header {background: #BBB}
-            tr.even {background: #CCC}
-            tr.odd {background: #FFF}
-            div.markdown {margin-top: %(margin)dpx}
-        </style>
-        """).strip()
         # make room for the "header" widgets
-        css = css % {"margin": self._offset_top()}
-        # print("css = %s" % css)
-        html = '%s\n<div class="markdown">%s<span>' % (css, self._html)
+        margin = self._offset_top()
+        font = self.font()
+        key = (self._html, margin, font.key())
+        if key == self._html_key:
+            # same html, margin and font, the layout is still valid
+            return
+        self._html_key = key
+        html = document_html(self._html, margin)
         # print("setHtml <- %s" % html)
-        self._document.setDefaultFont(self.font())
+        self._document.setDefaultFont(font)
         self._document.setHtml(html)
     def resizeEvent(self, resize_event):
         size = self.page.size()
         #print("setPageSize <- %s" % size)
-        #old_size = self._document.pageSize()
         new_size = QSizeF(size.width(), size.height())
-        self._document.setPageSize(new_size)
+        if self._document.pageSize() != new_size:
+            self._document.setPageSize(new_size)
         #print("self.size = %s" % self.size())
         self._updateHtml()
+    def _pageRect(self, num):
+        """
+        Area of the document shown in page `num`, in document coordinates
+        """
+        width, height = self.page.width(), self.page.height()
+        if num == 0:
+            offset_top = self._offset_top()
+            return QRectF(0, offset_top, width, height - offset_top)
+        return QRectF(0, num * height, width, height)
     def paintEvent(self, paint_event):
         painter = QPainter(self)
-        if self._page_number == 0:
-            painter.setClipRect(QRectF(0, 0, self.page.width(), self.page.height()-self._offset_top()))
-            painter.translate(0, -self._offset_top())
-        else:
-            painter.setClipRect(QRectF(0, 0, self.page.width(), self.page.height()))
-            height = self.page.height()
-            painter.translate(0, -self._page_number*height)
-        self._document.drawContents(painter)
+        rect = self._pageRect(self._page_number)
+        painter.translate(0, -rect.top())
+        # drawContents clips to rect, the document layout skips all the
+        # blocks (and table rows) outside of it
+        self._document.drawContents(painter, rect)
     def pageCount(self):
         return self._document.pageCount()
     def setPageNumber(self, num):
-        print("setPageNumber <- %s" % num)
+        log.debug("setPageNumber <- %s", num)
         self._page_number = num
         self.update()
     def pageNumber(self):
@@ -360,27 +375,22 @@ def _vline(color="black",
 
 
 class AspectRatioSvgWidget(QSvgWidget):
-    def __init__(self, src, env, line, *args, **kwargs):
+    """
+    Svg widget keeping the aspect ratio of the image, the parsed svg is
+    shared with the other widgets using the same source (see `svg_renderer`)
+    through `renderers`, by default the process wide `svg_cache`.
+    """
+    def __init__(self, src, env, line, renderers=None, *args, **kwargs):
         super(AspectRatioSvgWidget, self).__init__(*args, **kwargs)
         policy = self.sizePolicy()
         self.setSizePolicy(policy)
-        if src.startswith("data://"):
-            if env is None:
-                raise errors.TagError("Cannot use data:// without `env`")
-            multikey = src[len("data://"):]
-            keys = multikey.split(":")
-            # data://preview:ID -> env["preview"][ID]
-            data = env
-            for key in keys:
-                try:
-                    data = data[key]
-                except KeyError as err:
-                    raise errors.ParseError("%s: parsing %s at line %s" % (err, src, line))
-            self.load(QByteArray(data))
-        else:
-            self.load(src)
-        if not self.renderer().isValid():
-            raise errors.TagError("Invalid svg in src='%s' at line %s" % (src, line))
+        self._renderer = svg_renderer(src, env, line, renderers)
+
+    def renderer(self):
+        return self._renderer
+
+    def sizeHint(self):
+        return self._renderer.defaultSize()
 
     def paintEvent(self, paint_event):
         painter = QPainter(self)
@@ -388,7 +398,7 @@ class AspectRatioSvgWidget(QSvgWidget):
 
         default_width, default_height = view_box.width(), view_box.height()
         if default_width == 0 or default_height == 0:
-            print("WARNING: 0x0 image")
+            log.warning("0x0 image")
             return
 
         svg_width, svg_height = view_box.width(), view_box.height()
@@ -420,18 +430,12 @@ def _svg(src="",
     """
     Svg tag, provide a pointer to a valid svg file
     """
+    renderers = kwargs.pop("renderers", None)
     try:
-        svg = AspectRatioSvgWidget(src, kwargs["env"], kwargs['line'])
+        svg = AspectRatioSvgWidget(src, kwargs["env"], kwargs['line'], renderers)
     except (errors.TagError, errors.ParseError):
-        error_svg = b"""
-                    <svg>
-                    <rect width="100%" height="100%" fill='white' stroke="red" stroke-width="1"/>
-                    <text fill="red" font-size="8" font-family="Verdana" x="30%" y="45%">
-                    Error: Missing svg
-                    </text>
-                    </svg>"""
         svg = QSvgWidget()
-        svg.load(QByteArray(error_svg))
+        svg.load(QByteArray(ERROR_SVG))
 
     _set_widget(svg,
                 layout=layout,
@@ -454,25 +458,25 @@ def _image(src="",
            name="image",
            **kwargs):
     """
-    Image tag, provide a pointer to a valid image file
+    Image tag, provide a pointer to a valid image file or a `data://` source
     """
-    pixmap = QPixmap(src)
-    if width is not None and height is not None:
-        pixmap = pixmap.scaled(int(width), int(height), transformMode=Qt.SmoothTransformation)
-    elif width is not None:
-        pixmap = pixmap.scaledToWidth(int(width), mode=Qt.SmoothTransformation)
-    elif height is not None:
-        pixmap = pixmap.scaledToHeight(int(height), mode=Qt.SmoothTransformation)
+    try:
+        scaled = scaled_image(src,
+                              int(width) if width is not None else None,
+                              int(height) if height is not None else None,
+                              kwargs["env"], kwargs["line"])
+    except (errors.TagError, errors.ParseError):
+        scaled = QImage()
 
     image = QLabel()
-    if pixmap.isNull():
+    if scaled.isNull():
         import os
         if os.path.exists(src):
             image.setText(os.path.basename(src))
         else:
             image.setText("")
     else:
-        image.setPixmap(pixmap)
+        image.setPixmap(QPixmap.fromImage(scaled))
     _set_widget(image,
                 layout=layout,
                 parent=widget,
@@ -483,175 +487,83 @@ def _image(src="",
     return image
 
 
-# Attributes parsers
+# Tag dispatch table, tag name -> _<tag> function
+_TAGS = {
+    "report": _report,
+    "section": _section,
+    "col": _col,
+    "row": _row,
+    "label": _label,
+    "text": _text,
+    "hline": _hline,
+    "vline": _vline,
+    "svg": _svg,
+    "image": _image,
+}
 
-def _parse_spacing(value, line):
-    try:
-        return int(value)
-    except:
-        raise errors.ParseError("Invalid value %r for `spacing` at line %s, provide a valid number" % (value, line))
-
-def _parse_margins(value, line):
-    try:
-        return tuple(int(v.strip()) for v in value.strip("()").split(","))
-    except:
-        raise errors.ParseError("Invalid value %r for `margins` at line %s, provide 4 comma separated numbers, es. (3,3,4,4)" % (value, line))
-
-def _parse_size(value, line):
-    try:
-        return tuple(int(v.strip()) for v in value.strip("()").split(","))
-    except:
-        raise errors.ParseError("Invalid value %r for `size` at line %s, provide 2 comma separated numbers, es. (300,400)" % (value, line))
-
-def _parse_line_width(value, line):
-    try:
-        return int(value.strip())
-    except:
-        raise errors.ParseError("Invalid value %r for `line_width` at line %s, provide a valid numbers" % (value, line))
-
-def _parse_color(value, line):
-    try:
-        return QColor(value)
-    except:
-        raise errors.ParseError("Invalid color %r at line %s, provide a valid QColor" % (value, line))
-
-if __debug__:
-    def _parse_src(value, line):
-        if value.startswith("data://"):
-            # postpone check, needs `env`
-            # FIXME: spostare il check qua invece che in AspectRatioSvgWidget?
-            # se lo converto qua in QByteArray nella classe faccio sempre solo la load
-            pass
-        else:
-            import os
-            if not os.path.exists(value):
-                print("'%s' at line %s does not exist" % (value, line))
-        return value
-
-# Markdown helpers
-
-class QTextEditRenderer(mistune.Renderer):
-    """
-    QTextEdit targetted renderer with:
-
-    - full width tables
-    - odd / even rows
-    - use cell `align` attribute instead of `style`
-    """
-    def __init__(self, *args, **kwargs):
-        super(QTextEditRenderer, self).__init__(*args, **kwargs)
-        self._even_odd = False
-    def table(self, header, body):
-        out = super(QTextEditRenderer, self).table(header, body)
-        return out.replace("<table>", '<table width="100%">', 1)
-    def table_row(self, content):
-        out = super(QTextEditRenderer, self).table_row(content)
-        if content.strip().startswith("<th>"):
-            cls = 'class="header"'
-        else:
-            cls = 'class="even"' if self._even_odd else 'class="odd"'
-            self._even_odd = not self._even_odd
-        out = out.replace("<tr>", "<tr %s>" % cls, 1)
-        return out
-    def table_cell(self, content, **flags):
-        if flags['header']:
-            tag = 'th'
-        else:
-            tag = 'td'
-        align = flags['align']
-        if not align:
-            return '<%s>%s</%s>\n' % (tag, content, tag)
-        return '<%s align="%s">%s</%s>\n' % (tag, align, content, tag)
 
 # Entrypoint
 
-def parse(source, env=None):
-    p = xml.parsers.expat.ParserCreate()
-    if isinstance(source, string_types):
-        _parse = p.Parse
-    else:
-        _parse = p.ParseFile
-
-    tags = []
+def _build(root, env, renderers):
+    """
+    Instantiate the widgets of the `root` element and its children, returns
+    the section widgets found.
+    """
+    profiler = profiling.active
     widgets = []
     layouts = []
     pages = []
-    buffers = {"text": [], "label": []}
-
-    parsers = {}
-    for parser_name in globals():
-        if parser_name.startswith("_parse_"):
-            attr = parser_name[len("_parse_"):]
-            parsers[attr] = globals()[parser_name]
-
-    def x(tag):
-        hook = globals()["_"+tag]
-        def f(*args, **kwargs):
-            # parse non string arguments
-            for attr in kwargs:
-                if attr in parsers:
-                    try:
-                        kwargs[attr] = parsers[attr](kwargs[attr], line=p.ErrorLineNumber)
-                    except ValueError as v:
-                        raise errors.ParseError("error parsing %s: %s" % (attr, v))
-
-            if widgets:
-                kwargs["widget"] = widgets[-1]
-            if layouts:
-                kwargs["layout"] = layouts[-1]
-
-            if tag == "svg":
-                kwargs["env"] = env
-
-            # def nfw(w):
-            #     if isinstance(w, QObject):
-            #         return "<name=%s>" % w.objectName()
-            #     else:
-            #         return w
-            # named_args = tuple(nfw(a) for a in args)
-            # named_kwargs = {k: nfw(kwargs[k]) for k in kwargs}
-            # print("%s %s %s)" % ("  "*len(tags), named_args, named_kwargs))
-
-            # print("_%s(*%r, **%r)" % (tag, args, kwargs))
-            obj = hook(line=p.ErrorLineNumber, *args, **kwargs)
-            if tag == "report":
-                if __debug__:
-                    print("this template use version %s" % obj)
-            elif tag in ("col", "row"):
-                layouts.append(obj)
-            else:
-                if tag == "section":
-                    pages.append(obj)
-                    layouts.append(obj.layout())
-                widgets.append(obj)
-        return f
-
-    def start_element(tag, attrs):
-        tags.append(tag)
-        # print("%s<%s>" % ("  "*len(tags), tag))
-        x(tag)(**attrs)
-
-    def end_element(tag):
+
+    def start_element(element):
+        tag = element.tag
+        try:
+            hook = _TAGS[tag]
+        except KeyError:
+            raise errors.TagError("unknown tag <%s> at line %s" % (tag, element.line))
+        kwargs = dict(element.attrs)
+
+        if widgets:
+            kwargs["widget"] = widgets[-1]
+        if layouts:
+            kwargs["layout"] = layouts[-1]
+
+        if tag in ("svg", "image"):
+            kwargs["env"] = env
+        if tag == "svg":
+            kwargs["renderers"] = renderers
+
+        if profiler is not None:
+            start = profiling.clock()
+        obj = hook(line=element.line, **kwargs)
+        if profiler is not None:
+            profiler.record("build", start, tag)
+        if tag == "report":
+            log.debug("this template use version %s", obj)
+        elif tag in ("col", "row"):
+            layouts.append(obj)
+        else:
+            if tag == "section":
+                pages.append(obj)
+                layouts.append(obj.layout())
+            widgets.append(obj)
+
+    def end_element(element):
+        tag = element.tag
         if tag == "text":
-            if buffers["text"]:
+            if element.text:
                 widget = widgets[-1] if widgets else None
                 if isinstance(widget, TextViewer):
-                    text = textwrap.dedent("".join(buffers["text"])).strip()
-                    # default bbcode parser change \n with <br> we force it to \n to avoid changes
-                    # 'raplace_cosmetic' change symbols into ascii code for html and we don't want that too
-                    bbcode.g_parser = bbcode.Parser(newline='\n', replace_cosmetic=False)
-                    code = bbcode.render_html(text)
-                    html = mistune.Markdown(QTextEditRenderer())(code)
+                    html = text_html(element.text)
+                    if profiler is not None:
+                        start = profiling.clock()
                     widget.setHtml(html)
-            buffers["text"] = []
+                    if profiler is not None:
+                        profiler.record("layout", start, tag)
         elif tag == "label":
-            if buffers["label"]:
+            if element.text:
                 widget = widgets[-1] if widgets else None
                 if isinstance(widget, QLabel):
-                    text = "".join(buffers["label"]).strip()
-                    text = mistune.markdown(text)
-                    widget.setText(text.strip())
-            buffers["label"] = []
+                    widget.setText(label_html(element.text))
 
         if tag == "report":
             pass
@@ -661,24 +573,185 @@ def parse(source, env=None):
             if tag == "section":
                 layouts.pop()
             widgets.pop()
-        # print("%s</%s>" % ("  "*len(tags), tag))
-        popped_name = tags.pop()
-        assert popped_name == tag, (popped_name, tag)
 
-    def char_data(data):
-        tag = tags[-1] if tags else None
-        if tag in buffers:
-            buffers[tag] += [data]
+    def walk(element):
+        start_element(element)
+        for child in element.children:
+            walk(child)
+        end_element(element)
 
-    p.StartElementHandler = start_element
-    p.EndElementHandler = end_element
-    p.CharacterDataHandler = char_data
-
-    _parse(source)
+    walk(root)
 
     return pages
 
 
+class LazyPage(object):
+    """
+    Handle of a <section> returned by `build(..., lazy=True)`, the section
+    widgets are created by the first `widget()` call and destroyed by
+    `release()`, a later `widget()` builds them again.
+    """
+    def __init__(self, element, env=None, renderers=None):
+        self.element = element
+        self.name = dict(element.attrs).get("name")
+        self._env = env
+        self._renderers = renderers
+        self._widget = None
+        self._prefetched = None
+
+    def prefetch(self):
+        """
+        Start loading the assets of the section in background (see
+        `prefetch_assets`), es. while the previous page is painted
+        """
+        if self._prefetched is None and self._widget is None:
+            self._prefetched = prefetch_assets(self.element, self._env)
+
+    def widget(self):
+        if self._widget is None:
+            self.prefetch()
+            try:
+                self._widget = _build(self.element, self._env, self._renderers)[0]
+            finally:
+                self.cancel_prefetch()
+        return self._widget
+
+    def cancel_prefetch(self):
+        """
+        Forget the pending `prefetch`, es. if the section won't be built,
+        the assets already loaded stay in the caches
+        """
+        if self._prefetched is not None:
+            requests, self._prefetched = self._prefetched, None
+            release_prefetched(requests)
+
+    def release(self):
+        self.cancel_prefetch()
+        if self._widget is not None:
+            widget, self._widget = self._widget, None
+            sip.delete(widget)
+
+
+def _destroy(page):
+    if isinstance(page, LazyPage):
+        page.release()
+    elif not sip.isdeleted(page):
+        # the whole section tree: children, layouts, QTextDocuments, pixmaps
+        sip.delete(page)
+
+
+def page_widget(page):
+    """
+    The widget of `page`, built if it is a `LazyPage`
+    """
+    return page.widget() if isinstance(page, LazyPage) else page
+
+
+def build(template, env=None, renderers=None, lazy=False):
+    """
+    Instantiate the widgets of a compiled `template` (see `compile_template`),
+    `env` provides the data for `data://` sources. Returns the list of pages.
+
+    `renderers` is an optional dict where the parsed svgs are kept and
+    shared, by default they are shared by the whole process through
+    `svg_cache`. Image and svg files are loaded in background while the
+    widgets are created (see `prefetch_assets`).
+
+    If `lazy` is True a `LazyPage` for each section is returned instead, so
+    only the sections being painted are kept in memory; their assets are
+    loaded when they are built (or while the previous page is painted by
+    `iter_paint_pages`).
+    """
+    if profiling.active is not None:
+        profiling.active.set_template(template)
+    if not lazy:
+        requests = prefetch_assets(template, env)
+        try:
+            return _build(template.root, env, renderers)
+        finally:
+            release_prefetched(requests)
+    root = template.root
+    version = _report(line=root.line, **dict(root.attrs))
+    log.debug("this template use version %s", version)
+    return [LazyPage(element, env, renderers)
+            for element in root.children if element.tag == "section"]
+
+
+class Report(object):
+    """
+    The pages of a report built from `template` (compiled or a source, see
+    `build` for the other arguments), as a context manager that destroys
+    the widgets on exit instead of waiting for the garbage collector:
+
+        with Report(template, env, lazy=True) as report:
+            paint_pages(printer, report.pages)
+
+    The svg renderers are not destroyed, they are shared through
+    `svg_cache` (or the given `renderers`) by the next reports.
+    """
+    def __init__(self, template, env=None, renderers=None, lazy=False):
+        if not isinstance(template, Template):
+            template = compile_template(template)
+        self.template = template
+        self.pages = build(template, env, renderers, lazy)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __iter__(self):
+        return iter(self.pages)
+
+    def close(self):
+        """
+        Delete the widgets of all the pages, they can't be used anymore
+        """
+        pages, self.pages = self.pages, []
+        for page in pages:
+            _destroy(page)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def parse(source, env=None, lazy=False):
+    """
+    Parse a wreport `source` (the xml as a string or an open file) and build
+    its widgets, the compiled template is cached (see `compile_template`).
+    With `lazy` the pages are `LazyPage` handles (see `build`).
+    """
+    return build(compile_template(source), env, lazy=lazy)
+
+
+def iterparse(source, env=None, renderers=None, lazy=False, chunk_size=64 * 1024):
+    """
+    Streaming `parse`, yields the page of each <section> (a `LazyPage` if
+    `lazy`) as soon as its end tag is read from `source`, a string, an open
+    file, a socket `makefile()` or an iterable of chunks (see
+    `iter_sections`). The template is not cached.
+
+    Pass the generator to `iter_paint_pages` to print the first pages while
+    the rest of the document is still arriving.
+    """
+    def check_report(report):
+        # as soon as <report> is read, like `parse` a missing version raises
+        version = _report(line=report.line, **dict(report.attrs))
+        log.debug("this template use version %s", version)
+
+    for report, section in iter_sections(source, chunk_size, check_report):
+        if lazy:
+            yield LazyPage(section, env, renderers)
+            continue
+        requests = prefetch_assets(section, env)
+        try:
+            page = _build(section, env, renderers)[0]
+        finally:
+            release_prefetched(requests)
+        yield page
+
+
 # Command line
 
 def demo(template):
@@ -0,0 +1,165 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+"""
+Opt-in per phase timing of parse and paint.
+
+    from wreports import profiling
+
+    with profiling.profile() as profiler:
+        pages = wreports.parse(open("report.wrp", "rb"), env)
+        wreports.paint_pages(printer, pages)
+    print(profiler.report())
+
+Each timed step is stored as a `Record(phase, tag, template, seconds)`,
+phases are:
+
+- xml: expat parsing of the template, attributes excluded
+- attributes: conversion of the tag attributes
+- markup: bbcode/markdown to html conversion (render cache misses only)
+- build: widget (or headless box) construction, svg and image loads
+  included (they are reported on their own too)
+- layout: section resize and text layout
+- svg: svg loading (svg cache misses only)
+- image: image decode and scaling (image cache misses only)
+- paint: painting of each printed page
+
+When disabled (the default) `active` is None and the instrumented code only
+pays for that check.
+"""
+from __future__ import print_function, absolute_import, division
+
+import time
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+__all__ = ["Record", "Profiler", "enable", "disable", "profile"]
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+# the enabled `Profiler`, None when profiling is disabled
+active = None
+
+
+class Record(namedtuple("Record", "phase tag template seconds")):
+    """
+    Time spent in one step of `phase`, for a `tag` (if any) of `template`
+    (its path or content hash, if known).
+    """
+    __slots__ = ()
+
+
+def template_name(template):
+    """
+    Short name of a compiled template (or of its cache key)
+    """
+    key = getattr(template, "key", template)
+    if key is None:
+        return None
+    if key[0] == "path":
+        return key[1]
+    return "%s:%s" % (key[0], key[1][:12])
+
+
+class Profiler(object):
+    """
+    Collects the `Record`s of the instrumented code, thread safe. The
+    template of the records is the last one set with `set_template` in the
+    same thread.
+    """
+    def __init__(self):
+        self.records = []
+        self._local = threading.local()
+
+    def set_template(self, template):
+        self._local.template = template_name(template)
+
+    def add(self, phase, seconds, tag=None, template=None):
+        if template is None:
+            template = getattr(self._local, "template", None)
+        # list.append is atomic, no lock needed
+        self.records.append(Record(phase, tag, template, seconds))
+
+    def record(self, phase, start, tag=None, template=None):
+        """
+        Record the time elapsed since `start` (a `clock()` value)
+        """
+        self.add(phase, clock() - start, tag, template)
+
+    def wrap(self, phase, func, tag=None):
+        """
+        `func` recording its calls, es. for jobs run in other threads
+        """
+        template = getattr(self._local, "template", None)
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(phase, start, tag, template)
+        return timed
+
+    def clear(self):
+        del self.records[:]
+
+    def summary(self, fields=("phase", "tag")):
+        """
+        Dict `fields values -> (count, seconds)` of the records grouped by
+        `fields`, es. `summary(("template", "phase"))`.
+        """
+        totals = {}
+        for record in list(self.records):
+            key = tuple(getattr(record, field) for field in fields)
+            count, seconds = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, seconds + record.seconds)
+        return totals
+
+    def export(self):
+        """
+        The records as a list of dicts, ready for json or csv
+        """
+        return [dict(zip(Record._fields, record)) for record in list(self.records)]
+
+    def report(self, fields=("phase", "tag")):
+        """
+        Text table of the `summary`, slowest first
+        """
+        rows = sorted(self.summary(fields).items(), key=lambda item: -item[1][1])
+        lines = ["%-40s %8s %12s" % ("/".join(fields), "count", "ms")]
+        for key, (count, seconds) in rows:
+            name = "/".join("-" if value is None else str(value) for value in key)
+            lines.append("%-40s %8d %12.3f" % (name, count, seconds * 1000))
+        return "\n".join(lines)
+
+
+def enable(profiler=None):
+    """
+    Start recording in `profiler` (a new `Profiler` by default), returned
+    """
+    global active
+    active = profiler if profiler is not None else Profiler()
+    return active
+
+
+def disable():
+    """
+    Stop recording, returns the profiler that was active
+    """
+    global active
+    profiler, active = active, None
+    return profiler
+
+
+@contextmanager
+def profile(profiler=None):
+    """
+    Profile the body of the `with` block, see `enable`
+    """
+    profiler = enable(profiler)
+    try:
+        yield profiler
+    finally:
+        disable()
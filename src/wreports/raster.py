@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+"""
+Raster output, pages as images (PNG, TIFF, JPEG, ...).
+
+Widgets can only be painted in the GUI thread, so each page is painted
+once, recorded in a QPicture, and the pictures are rasterized in parallel
+on QImages (QImage painting is thread safe):
+
+    export_images(pages, "report-{index}.png", dpi=150)
+    export_images(pages, "thumb-{index}.png", thumbnail=(200, 200))
+"""
+from __future__ import print_function, absolute_import, division
+
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+try:
+    from PyQt5.Qt import Qt
+    from PyQt5.QtGui import QPicture, QPainter, QImage
+    from PyQt5.QtPrintSupport import QPrinter
+except ImportError:
+    from PyQt4.Qt import Qt
+    from PyQt4.QtGui import QPicture, QPainter, QImage, QPrinter
+
+from . import errors
+from .painter import paint_page, pdf_printer, picture_data, load_picture, _iter_page_widgets, _page_rect
+
+__all__ = ["record_pages", "render_images", "export_images"]
+
+
+def record_pages(pages, printer=None, unit=QPrinter.DevicePixel):
+    """
+    Paint the `pages` as they would be printed on `printer` (by default a
+    `pdf_printer`), yields a QPicture for each printed page.
+    """
+    if printer is None:
+        printer = pdf_printer()
+    page_rect = _page_rect(printer, unit)
+    for widget in _iter_page_widgets(pages):
+        yield _record_page(widget, page_rect)
+
+
+def _record_page(widget, page_rect):
+    picture = QPicture()
+    painter = QPainter(picture)
+    picture.setBoundingRect(page_rect.toRect())
+    paint_page(painter, widget, page_rect, picture=False)
+    painter.end()
+    return picture
+
+
+def _rasterize(data, width, height, scale):
+    # runs in the pool, a picture for each thread
+    picture = load_picture(data)
+    image = QImage(max(1, int(round(width * scale))), max(1, int(round(height * scale))),
+                   QImage.Format_RGB32)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    painter.setRenderHints(QPainter.Antialiasing | QPainter.TextAntialiasing |
+                           QPainter.SmoothPixmapTransform)
+    painter.scale(scale, scale)
+    painter.drawPicture(0, 0, picture)
+    painter.end()
+    return image
+
+
+def _save(data, width, height, scale, filename, image_format, quality):
+    image = _rasterize(data, width, height, scale)
+    if not image.save(filename, image_format, quality):
+        raise errors.RenderError("cannot write %s" % filename)
+    return filename
+
+
+def _raster_jobs(pages, dpi, thumbnail, printer, unit):
+    """
+    `(picture data, width, height, scale)` for each printed page
+    """
+    if printer is None:
+        printer = pdf_printer()
+    page_rect = _page_rect(printer, unit)
+    width, height = page_rect.width(), page_rect.height()
+    if thumbnail is not None:
+        scale = min(thumbnail[0] / width, thumbnail[1] / height)
+    else:
+        scale = dpi / printer.resolution()
+    for picture in record_pages(pages, printer, unit):
+        yield picture_data(picture), width, height, scale
+
+
+def _pipeline(func, jobs, threads):
+    """
+    Run `func(*job)` for each job on a pool of `threads`, yields the results
+    in order, at most two jobs for thread are queued.
+    """
+    threads = threads or multiprocessing.cpu_count()
+    pool = ThreadPool(threads)
+    pending = collections.deque()
+    try:
+        for job in jobs:
+            pending.append(pool.apply_async(func, job))
+            if len(pending) >= 2 * threads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+def render_images(pages, dpi=150, thumbnail=None, printer=None, unit=QPrinter.DevicePixel,
+                  threads=None):
+    """
+    Rasterize the `pages`, laid out as on `printer` (by default a
+    `pdf_printer`), at `dpi` or, if `thumbnail` is a `(width, height)`,
+    fitted in it. Yields a QImage for each printed page, in order.
+
+    Pages are recorded in the calling (GUI) thread and rasterized on a pool
+    of `threads` (default: one per core).
+    """
+    jobs = _raster_jobs(pages, dpi, thumbnail, printer, unit)
+    return _pipeline(_rasterize, jobs, threads)
+
+
+def export_images(pages, pattern, dpi=150, thumbnail=None, image_format=None, quality=-1,
+                  printer=None, unit=QPrinter.DevicePixel, threads=None):
+    """
+    Write an image for each printed page, `pattern` is formatted with the
+    page `index`, es. "page-{index:03}.png". The `image_format` (es. "PNG")
+    is guessed from the extension if not given, `quality` is for lossy
+    formats (0-100, -1 for the default). See `render_images` for the other
+    arguments.
+
+    Returns the list of the written files.
+    """
+    jobs = ((data, width, height, scale, pattern.format(index=index), image_format, quality)
+            for index, (data, width, height, scale)
+            in enumerate(_raster_jobs(pages, dpi, thumbnail, printer, unit)))
+    return list(_pipeline(_save, jobs, threads))
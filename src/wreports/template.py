@@ -0,0 +1,269 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+from __future__ import print_function, absolute_import, division
+
+import xml.parsers.expat
+import hashlib
+import sys
+import os
+import logging
+from stat import S_ISREG
+from collections import namedtuple
+
+from . import errors
+from . import profiling
+from .cache import LRUCache
+
+PY3 = sys.version_info.major == 3
+if PY3:
+    string_types = (str, bytes)
+else:
+    from types import StringTypes as string_types
+
+__all__ = ["Element", "Template", "compile_template", "load_template", "template_cache",
+           "iter_sections"]
+
+log = logging.getLogger(__name__)
+
+
+# Compiled template, an immutable tree of elements, built once per template
+# and instantiated many times by `parser.build`.
+#
+# - `attrs` is a tuple of (name, value) pairs, values already converted by the
+#   `_parse_<name>` attribute parsers
+# - `text` is the character data of <text> and <label>, None otherwise (or if empty)
+# - `line` is the line of the start tag, used in error messages
+Element = namedtuple("Element", "tag attrs text line children")
+
+Template = namedtuple("Template", "root key")
+
+
+# Attributes parsers
+
+def _parse_spacing(value, line):
+    try:
+        return int(value)
+    except:
+        raise errors.ParseError("Invalid value %r for `spacing` at line %s, provide a valid number" % (value, line))
+
+def _parse_margins(value, line):
+    try:
+        return tuple(int(v.strip()) for v in value.strip("()").split(","))
+    except:
+        raise errors.ParseError("Invalid value %r for `margins` at line %s, provide 4 comma separated numbers, es. (3,3,4,4)" % (value, line))
+
+def _parse_size(value, line):
+    try:
+        return tuple(int(v.strip()) for v in value.strip("()").split(","))
+    except:
+        raise errors.ParseError("Invalid value %r for `size` at line %s, provide 2 comma separated numbers, es. (300,400)" % (value, line))
+
+def _parse_line_width(value, line):
+    try:
+        return int(value.strip())
+    except:
+        raise errors.ParseError("Invalid value %r for `line_width` at line %s, provide a valid numbers" % (value, line))
+
+def _parse_color(value, line):
+    # imported here, templates without colors are compiled without Qt
+    try:
+        from PyQt5.QtGui import QColor
+    except ImportError:
+        from PyQt4.QtGui import QColor
+    try:
+        return QColor(value)
+    except:
+        raise errors.ParseError("Invalid color %r at line %s, provide a valid QColor" % (value, line))
+
+if __debug__:
+    def _parse_src(value, line):
+        if value.startswith("data://"):
+            # postpone check, needs `env`
+            # FIXME: spostare il check qua invece che in AspectRatioSvgWidget?
+            # se lo converto qua in QByteArray nella classe faccio sempre solo la load
+            pass
+        else:
+            if not os.path.exists(value):
+                log.warning("'%s' at line %s does not exist", value, line)
+        return value
+
+
+# attribute name -> parser, built once at import time
+_ATTRIBUTE_PARSERS = dict((name[len("_parse_"):], func)
+                          for name, func in list(globals().items())
+                          if name.startswith("_parse_"))
+
+# tags whose character data is kept in `Element.text`
+_TEXT_TAGS = ("text", "label")
+
+
+class _Compiler(object):
+    """
+    Expat handlers building the `Element` tree, attributes are converted
+    as soon as each start tag is seen.
+
+    If `on_section` is given, each closed top level <section> is passed to
+    `on_section(report, section)` instead of being kept in the tree, and
+    `on_report(report)` (if given) is called as soon as the root start tag
+    is seen.
+    """
+    def __init__(self, on_section=None, on_report=None):
+        self._on_section = on_section
+        self._on_report = on_report
+        self._profiler = profiling.active
+        self._attributes_time = 0.0
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.char_data
+        # stack of open elements: [tag, attrs, line, text buffer, children]
+        self._open = [[None, (), 0, [], []]]
+
+    def start_element(self, tag, attrs):
+        line = self.parser.ErrorLineNumber
+        if self._profiler is not None:
+            start = profiling.clock()
+        parsed = []
+        for attr, value in attrs.items():
+            if attr in _ATTRIBUTE_PARSERS:
+                try:
+                    value = _ATTRIBUTE_PARSERS[attr](value, line=line)
+                except ValueError as v:
+                    raise errors.ParseError("error parsing %s: %s" % (attr, v))
+            parsed.append((attr, value))
+        if self._profiler is not None:
+            elapsed = profiling.clock() - start
+            self._attributes_time += elapsed
+            self._profiler.add("attributes", elapsed, tag)
+        if self._on_report is not None and len(self._open) == 1:
+            self._on_report(Element(tag, tuple(parsed), None, line, ()))
+        self._open.append([tag, tuple(parsed), line, [], []])
+
+    def end_element(self, tag):
+        popped_name, attrs, line, buf, children = self._open.pop()
+        assert popped_name == tag, (popped_name, tag)
+        text = "".join(buf) if buf else None
+        element = Element(tag, attrs, text, line, tuple(children))
+        parent = self._open[-1]
+        if self._on_section is not None and tag == "section" and len(self._open) == 2:
+            report = Element(parent[0], parent[1], None, parent[2], ())
+            self._on_section(report, element)
+        else:
+            parent[4].append(element)
+
+    def char_data(self, data):
+        current = self._open[-1]
+        if current[0] in _TEXT_TAGS:
+            current[3].append(data)
+
+    def feed(self, data, final=False):
+        if self._profiler is None:
+            self.parser.Parse(data, final)
+            return
+        self._attributes_time = 0.0
+        start = profiling.clock()
+        self.parser.Parse(data, final)
+        self._profiler.add("xml", profiling.clock() - start - self._attributes_time)
+
+    def compile(self, data):
+        self.feed(data, True)
+        children = self._open[0][4]
+        if not children:
+            raise errors.ParseError("empty template")
+        return children[0]
+
+
+# Template cache
+
+template_cache = LRUCache(maxsize=64)
+
+def _content_key(data):
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    return ("sha1", hashlib.sha1(data).hexdigest())
+
+def _file_key(source):
+    """
+    Cache key of the open file `source`, None if it isn't a regular file
+    """
+    try:
+        stat = os.fstat(source.fileno())
+    except (AttributeError, ValueError, OSError):
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    path = getattr(source, "name", None)
+    # the name is only for reports, it may be relative to an older cwd
+    name = os.path.abspath(path) if isinstance(path, string_types) else None
+    return ("path", name, stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+
+def compile_template(source, cache=True):
+    """
+    Parse a wreport `source` (the xml as a string or an open file) into a
+    `Template`, an immutable tree that `parser.build` turns into widgets.
+
+    Compiled templates are kept in `template_cache`, keyed by the identity
+    (device and inode), mtime and size of real files and by content hash
+    otherwise.
+    """
+    key = None
+    if cache:
+        if not isinstance(source, string_types):
+            key = _file_key(source)
+        if key is None:
+            if not isinstance(source, string_types):
+                source = source.read()
+            key = _content_key(source)
+        template = template_cache.get(key)
+        if template is not None:
+            return template
+    if not isinstance(source, string_types):
+        source = source.read()
+    if profiling.active is not None:
+        profiling.active.set_template(key)
+    template = Template(_Compiler().compile(source), key)
+    if key is not None:
+        template_cache.put(key, template)
+    return template
+
+def _read_chunks(source, chunk_size):
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_sections(source, chunk_size=64 * 1024, on_report=None):
+    """
+    Incremental `compile_template`, parses `source` (the xml as a string, an
+    open file, a socket `makefile()` or an iterable of chunks) a chunk at a
+    time, yielding `(report, section)` as soon as each <section> end tag is
+    seen. `report` is the root `Element` without children, also passed to
+    `on_report(report)` as soon as its start tag is seen (es. to check its
+    attributes before any section arrives).
+
+    Sections are not kept, memory depends on the largest section only.
+    """
+    ready = []
+    compiler = _Compiler(lambda report, section: ready.append((report, section)), on_report)
+    if isinstance(source, string_types):
+        chunks = [source]
+    elif hasattr(source, "read"):
+        chunks = _read_chunks(source, chunk_size)
+    else:
+        chunks = source
+    for chunk in chunks:
+        compiler.feed(chunk)
+        for item in ready:
+            yield item
+        del ready[:]
+    compiler.feed(b"", True)
+    for item in ready:
+        yield item
+
+def load_template(path, cache=True):
+    """
+    Compile the template in file `path`, see `compile_template`.
+    """
+    with open(path, "rb") as source:
+        return compile_template(source, cache=cache)
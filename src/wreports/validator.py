@@ -0,0 +1,208 @@
+#!/usr/bin/env python2
+# encoding: utf-8
+"""
+Template validation without Qt.
+
+Checks tags, attributes (with the same parsers used by `compile_template`),
+enumerated values and nesting, reporting all the problems found in a single
+pass instead of stopping at the first one:
+
+    for problem in validate_file("report.wrp"):
+        print(problem)
+
+or from the command line:
+
+    python -m wreports.validator templates/*.wrp
+"""
+from __future__ import print_function, absolute_import, division
+
+import os
+import re
+import sys
+import xml.parsers.expat
+from collections import namedtuple
+
+from .template import _ATTRIBUTE_PARSERS, string_types
+
+__all__ = ["Problem", "validate", "validate_file"]
+
+
+class Problem(namedtuple("Problem", "line severity message")):
+    """
+    A problem found at `line`, `severity` is "error" (parse would fail or
+    misbehave) or "warning" (es. a missing src file, replaced by an error
+    image).
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return "%s: %s: %s" % (self.line, self.severity, self.message)
+
+
+# attributes accepted by each tag, as the `_<tag>` functions of `parser`
+# (plus `_set_widget` and `_set_layout` for widgets and layouts) take them
+_WIDGET = ("name", "horizontal", "vertical", "size", "alignment", "hstretch", "vstretch", "style")
+_LAYOUT = ("name", "spacing", "margins", "alignment", "stretch")
+
+TAG_ATTRIBUTES = {
+    "report": ("version",),
+    "section": _LAYOUT + ("child_layout", "style", "metadata"),
+    "col": _LAYOUT,
+    "row": _LAYOUT,
+    "label": _WIDGET + ("word_wrap",),
+    "text": _WIDGET,
+    "hline": _WIDGET + ("color", "line_width"),
+    "vline": _WIDGET + ("color", "line_width"),
+    "svg": _WIDGET + ("src",),
+    "image": _WIDGET + ("src", "width", "height"),
+}
+
+# tags that can contain other tags
+_CONTAINERS = {
+    "report": ("section",),
+    "section": ("col", "row", "label", "text", "hline", "vline", "svg", "image"),
+    "col": ("col", "row", "label", "text", "hline", "vline", "svg", "image"),
+    "row": ("col", "row", "label", "text", "hline", "vline", "svg", "image"),
+}
+
+_SIZE_POLICIES = ("Fixed", "Minimum", "Maximum", "Preferred", "MinimumExpanding",
+                  "Expanding", "Ignored")
+
+_ALIGNMENTS = ("AlignLeft", "AlignLeading", "AlignRight", "AlignTrailing", "AlignHCenter",
+               "AlignJustify", "AlignAbsolute", "AlignTop", "AlignBottom", "AlignVCenter",
+               "AlignBaseline", "AlignCenter")
+
+# enumerated attributes, name -> valid values
+_CHOICES = {
+    "horizontal": _SIZE_POLICIES,
+    "vertical": _SIZE_POLICIES,
+    "alignment": _ALIGNMENTS,
+    "child_layout": ("col", "row"),
+    "word_wrap": ("True", "False"),
+}
+
+_INTEGERS = ("hstretch", "vstretch", "stretch", "width", "height")
+
+# numbers expected in tuple attributes
+_ARITY = {"margins": 4, "size": 2}
+
+# QColor accepts #rgb, #rrggbb, #aarrggbb, #rrrgggbbb, #rrrrggggbbbb and the
+# svg color names, names are not checked against the list
+_COLOR = re.compile(r"^(#([0-9a-fA-F]{3}|[0-9a-fA-F]{6}|[0-9a-fA-F]{8}|[0-9a-fA-F]{9}|"
+                    r"[0-9a-fA-F]{12})|[a-zA-Z]+)$")
+
+
+def _check_attribute(tag, attr, value, line, base_dir, problems):
+    if attr not in TAG_ATTRIBUTES[tag]:
+        problems.append(Problem(line, "error", "unknown attribute %s=%r in <%s>" % (attr, value, tag)))
+    elif attr == "color":
+        if not _COLOR.match(value):
+            problems.append(Problem(line, "error", "invalid color %r in <%s>" % (value, tag)))
+    elif attr == "src":
+        if not value.startswith("data://") and base_dir is not None and \
+                not os.path.exists(os.path.join(base_dir, value)):
+            problems.append(Problem(line, "warning", "%r does not exist" % value))
+    elif attr in _CHOICES:
+        if value not in _CHOICES[attr]:
+            problems.append(Problem(line, "error", "invalid value %r for `%s` in <%s>, use %s"
+                                    % (value, attr, tag, "|".join(_CHOICES[attr]))))
+    elif attr in _INTEGERS:
+        try:
+            int(value)
+        except ValueError:
+            problems.append(Problem(line, "error", "invalid value %r for `%s` in <%s>, provide an integer"
+                                    % (value, attr, tag)))
+    elif attr in _ATTRIBUTE_PARSERS:
+        try:
+            parsed = _ATTRIBUTE_PARSERS[attr](value, line=line)
+        except Exception as err:
+            problems.append(Problem(line, "error", "error parsing %s in <%s>: %s" % (attr, tag, err)))
+            return
+        if attr in _ARITY and len(parsed) != _ARITY[attr]:
+            problems.append(Problem(line, "error", "invalid value %r for `%s` in <%s>, provide %d numbers"
+                                    % (value, attr, tag, _ARITY[attr])))
+
+
+class _Validator(object):
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self.problems = []
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self._open = []
+
+    def start_element(self, tag, attrs):
+        line = self.parser.ErrorLineNumber
+        problems = self.problems
+        if not self._open:
+            if tag != "report":
+                problems.append(Problem(line, "error", "the root tag is <%s>, not <report>" % tag))
+        else:
+            # children of unknown tags are checked only on their own
+            parent = self._open[-1]
+            allowed = _CONTAINERS.get(parent)
+            if parent in TAG_ATTRIBUTES and allowed is None:
+                problems.append(Problem(line, "error", "<%s> cannot contain other tags" % parent))
+            elif allowed is not None and tag in TAG_ATTRIBUTES and tag not in allowed:
+                problems.append(Problem(line, "error", "<%s> cannot contain <%s>" % (parent, tag)))
+        self._open.append(tag)
+        if tag not in TAG_ATTRIBUTES:
+            problems.append(Problem(line, "error", "unknown tag <%s>" % tag))
+            return
+        if tag == "report" and "version" not in attrs:
+            problems.append(Problem(line, "error", "missing version number in <report>"))
+        for attr, value in attrs.items():
+            _check_attribute(tag, attr, value, line, self.base_dir, problems)
+
+    def end_element(self, tag):
+        self._open.pop()
+
+    def validate(self, data):
+        try:
+            self.parser.Parse(data, True)
+        except xml.parsers.expat.ExpatError as err:
+            message = "xml: %s" % xml.parsers.expat.ErrorString(err.code)
+            self.problems.append(Problem(err.lineno, "error", message))
+        return self.problems
+
+
+def validate(source, base_dir=None):
+    """
+    List of the `Problem`s of a wreport `source` (the xml as a string or an
+    open file), empty if it is valid. If `base_dir` is given, relative `src`
+    files are looked up there.
+    """
+    if not isinstance(source, string_types):
+        source = source.read()
+    return _Validator(base_dir).validate(source)
+
+
+def validate_file(path):
+    """
+    `validate` the template in file `path`, `src` files are relative to its
+    directory.
+    """
+    with open(path, "rb") as source:
+        return validate(source, os.path.dirname(os.path.abspath(path)))
+
+
+def main(argv=None):
+    """
+    Validate the templates given on the command line, prints the problems
+    found, exits with 1 if there are errors.
+    """
+    paths = sys.argv[1:] if argv is None else argv
+    if not paths:
+        print("usage: python -m wreports.validator TEMPLATE...")
+        return 2
+    failed = False
+    for path in paths:
+        for problem in validate_file(path):
+            print("%s:%s" % (path, problem))
+            failed = failed or problem.severity == "error"
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())